@@ -1,7 +1,15 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from routers import scan, analyze, session, chat, tts      
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+from services import engine_registry
+from services.image_cache import ocr_cache, analysis_cache
+from services.ocr_engine import ocr_engine
+from services.message_store import message_writer
+from services.history_cache import session_history
+from services.tts_engine import tts_engine
+from services.job_queue import job_queue
 import os
 
 load_dotenv()
@@ -35,10 +43,45 @@ app.include_router(chat.router, prefix="/chat", tags=["chat"])
 app.include_router(tts.router)
 
 
+@app.on_event("startup")
+def warmup_models():
+    # Build the shared embedding model + index off the request path
+    if os.getenv("RAG_WARMUP", "true").lower() == "true":
+        engine_registry.warmup_in_background()
+    # Start the long-lived Tesseract workers before the first scan
+    ocr_engine.start()
+    message_writer.start()
+    # Resume jobs left queued (or running) by a previous process
+    job_queue.start(analyze.process_analysis_job)
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    job_queue.shutdown()
+    ocr_engine.shutdown()
+    # Flush queued chat messages before the worker exits
+    message_writer.drain()
+    await engine_registry.shutdown()
+
+
 @app.get("/")
 def health_check():
     return {
         "status": "Backend is running",
         "env": ENV
     }
-    
\ No newline at end of file
+
+
+@app.get("/ready")
+def readiness_check():
+    state = engine_registry.readiness()
+    state["ocr_cache"] = ocr_cache.stats()
+    state["analysis_cache"] = analysis_cache.stats()
+    state["ocr_engine"] = ocr_engine.stats()
+    state["message_writer"] = message_writer.stats()
+    state["session_history"] = session_history.stats()
+    state["tts"] = tts_engine.stats()
+    state["jobs"] = job_queue.stats()
+    if not engine_registry.is_ready():
+        return JSONResponse(status_code=503, content=state)
+    return state
@@ -0,0 +1,61 @@
+import argparse
+
+from services.engine_registry import get_rag_engine, get_explanation_store
+from services.rag_engine import parse_results
+
+BATCH_SIZE = 6  # Same size as a pipeline scan, keeps prompts within the 30s timeout
+
+
+def precompute(languages, force=False, batch_size=BATCH_SIZE):
+    """
+    Fill the explanation store for every knowledge doc in each language.
+    Entries that already exist are skipped unless force=True.
+    """
+    rag = get_rag_engine()
+    store = get_explanation_store()
+    documents = rag.vector_store.documents
+
+    for language in languages:
+        todo = [
+            doc for doc in documents
+            if force or store.get(doc, language) is None
+        ]
+        print(f"[{language}] {len(documents) - len(todo)} cached, {len(todo)} to generate")
+
+        for start in range(0, len(todo), batch_size):
+            batch = todo[start:start + batch_size]
+            names = [doc["ingredient"] for doc in batch]
+
+            try:
+                content = rag.explain_ingredients_batch(
+                    names,
+                    language=language,
+                    contexts={doc["ingredient"]: [rag.document_context(doc)] for doc in batch},
+                )
+                results = parse_results(content)
+            except Exception as e:
+                print(f"[{language}] Batch {names} failed: {e}")
+                continue
+
+            by_name = {str(r.get("ingredient", "")).lower(): r for r in results if isinstance(r, dict)}
+            for doc in batch:
+                result = by_name.get(doc["ingredient"].lower())
+                if result is None:
+                    print(f"[{language}] No result for {doc['ingredient']}")
+                    continue
+                store.put(doc, language, result)
+                print(f"[{language}] Stored {doc['ingredient']}")
+
+    print(f"Done. {store.stats()['size']} entries in {store.path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompute ingredient explanations for every knowledge doc."
+    )
+    parser.add_argument("--languages", nargs="+", default=["en", "hi"])
+    parser.add_argument("--force", action="store_true", help="Regenerate existing entries")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    precompute(args.languages, force=args.force, batch_size=args.batch_size)
@@ -1,11 +1,21 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from typing import Optional
-from database import supabase
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from services.message_store import save_message
+from services.ocr_engine import OCRBusyError, OCRTimeoutError
+from services.tts_engine import tts_engine, DEFAULT_VOICE_ID
+from services.job_queue import job_queue, RetryableJobError, DONE, FAILED
 import json
 import re
 import asyncio
 import functools
+import os
+from collections import deque
 router = APIRouter()
+
+ANALYZE_BATCH_MAX_IMAGES = int(os.getenv("ANALYZE_BATCH_MAX_IMAGES", "20"))
+JOB_EVENTS_POLL_INTERVAL = 0.5  # Seconds between store reads for /analyze/jobs/{id}/events
+LIVE_MAX_FRAME_BYTES = int(os.getenv("LIVE_MAX_FRAME_BYTES", str(5 * 1024 * 1024)))
 _pipeline = None
 
 def get_pipeline():
@@ -17,12 +27,122 @@ def get_pipeline():
     return _pipeline
 
 
+def save_user_upload(session_id: str, user_id: Optional[str]):
+    try:
+        user_message = {
+            "session_id": session_id,
+            "role": "user",
+            "content": "Image uploaded for analysis",      
+            "source": "image_upload"
+        }
+        if user_id:
+            user_message["user_id"] = user_id
+
+        save_message(user_message)
+
+    except Exception as e:
+        print(f"Error saving user message: {e}")
+        # Continue execution even if logging fails? Maybe.
+
+
+def save_assistant_message(session_id: str, user_id: Optional[str], content: str):
+    assistant_message = {
+         "session_id": session_id,
+         "role": "assistant",
+         "content": content,
+         "source": "analysis_result"
+    }
+    if user_id:
+        assistant_message["user_id"] = user_id
+
+    save_message(assistant_message)
+
+
+def format_analysis(result: dict, language: str) -> str:
+    """
+    Turn the pipeline result into chat Markdown, and add result["speech"]
+    for TTS. Returns the Markdown saved as the assistant message.
+    """
+    raw_analysis = result.get("analysis", "")
+    formatted_content = raw_analysis
+
+    try:
+         clean_json = raw_analysis
+         if "```json" in clean_json:
+             clean_json = clean_json.replace("```json", "").replace("```", "")
+         elif "```" in clean_json:
+             clean_json = clean_json.replace("```", "")
+
+         parsed = json.loads(clean_json)
+         if "results" in parsed and isinstance(parsed["results"], list):
+             formatted_content = ""
+             speech_content = ""
+             suggested_ingredients = []
+
+             for item in parsed["results"]:
+                 name = item.get('ingredient', 'Unknown')
+                 suggested_ingredients.append(name)    
+                 evidence = item.get('evidence', '')   
+                 explanation = item.get('explanation', '')
+                 safety = '⚠️ Caution' if 'risk' in evidence.lower() or 'unsafe' in evidence.lower() else '✅ Safe'
+
+                 formatted_content += f"### {name} {safety}\n{explanation}\n\n"
+                 clean_name = re.sub(r'\s*\(.*?\)', '', name)
+                 speech_content += f"{clean_name}. {explanation} "
+
+             if "hi" in language.lower():
+                 formatted_content += "\n\n**क्या आप इननमें से किसी के बारे में और जानना चाहते हैं? बस माइक टैप करे            और पूछें!** 🎙️"
+                 speech_content += "क्या आप इनमें से कि   िसी के बारे में और जानना चाहते हैं? बस माइक टैप करें और पूछे           ।"
+             else:
+                 formatted_content += "\n\n**Do you want to know more about any of these? Just tap the mic and ask!** 🎙️"
+                 speech_content += "Do you want to know more about any of these? Just tap the mic and ask."       
+
+             result["speech"] = speech_content
+         else:
+             # Localize fallback message if possible   
+             msg = result.get("message", "Analysis complete but no ingredients identified.")
+
+             # Handle specific error messages from pipeline
+             if "better quality image" in msg:
+                if "hi" in language.lower():
+                    msg = "कृपया थोड़ी बेहतर गुणवत्ता वाली इनज के साथ पुनः प्रयास करें।"
+                else:
+                    msg = "Please try again with a better quality image."
+             elif "No recognizable ingredients" in msg:
+                if "hi" in language.lower():
+                    msg = "कोई पहचान योग्य सामग्री नहीं मिली।"
+
+             formatted_content = msg
+             result["speech"] = formatted_content      
+
+    except Exception as e:
+         print(f"JSON formatting failed: {e}")
+         formatted_content = raw_analysis
+         # Ensure speech exists even on JSON parse failure
+         result["speech"] = "Analysis failed to parse."
+
+    # Fallback if speech is still missing (e.g. pipeline error with no message)
+    if "speech" not in result:
+         result["speech"] = result.get("error", "An unknown error occurred.")
+
+    # Update cleanup to be safe
+    if 'clean_json' in locals():
+        result["analysis"] = clean_json
+    else:
+        result["analysis"] = raw_analysis
+
+    return formatted_content
+
+
 @router.post("/analyze")
 async def analyze_image(
     image: UploadFile = File(...),
     session_id: str = Form(...),
     user_id: Optional[str] = Form(None),
-    language: str = Form("en")
+    language: str = Form("en"),
+    # Start synthesizing result["speech"] now so the follow-up /tts is a cache hit
+    prefetch_tts: bool = Form(False),
+    voice_id: str = Form(DEFAULT_VOICE_ID)
 ):
     if not image.content_type.startswith("image/"):        
         raise HTTPException(status_code=400, detail="Invalid image file")
@@ -38,21 +158,7 @@ async def analyze_image(
         user_id = None
 
     # 1. Save User Message
-    try:
-        user_message = {
-            "session_id": session_id,
-            "role": "user",
-            "content": "Image uploaded for analysis",      
-            "source": "image_upload"
-        }
-        if user_id:
-            user_message["user_id"] = user_id
-
-        supabase.table("messages").insert(user_message).execute()
-
-    except Exception as e:
-        print(f"Error saving user message: {e}")
-        # Continue execution even if logging fails? Maybe. 
+    save_user_upload(session_id, user_id)
 
     try:
         # 2. Analyze
@@ -64,93 +170,405 @@ async def analyze_image(
              print(f"DEBUG: Analysis type: {type(result['analysis'])}")
              print(f"DEBUG: Analysis preview: {result['analysis'][:100]}...")
 
-        # Format the content into Markdown before saving   
-        raw_analysis = result.get("analysis", "")
-        formatted_content = raw_analysis
+        formatted_content = format_analysis(result, language)
+        if prefetch_tts:
+            tts_engine.prefetch(result["speech"], voice_id)
+
+        save_assistant_message(session_id, user_id, formatted_content)
+
+        return {
+            "success": True,
+            "data": result
+        }
+
+    except OCRBusyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except OCRTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"Error during analysis or result saving: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/analyze/stream")
+async def analyze_image_stream(
+    image: UploadFile = File(...),
+    session_id: str = Form(...),
+    user_id: Optional[str] = Form(None),
+    language: str = Form("en"),
+    # Start synthesizing result["speech"] now so the follow-up /tts is a cache hit
+    prefetch_tts: bool = Form(False),
+    voice_id: str = Form(DEFAULT_VOICE_ID)
+):
+    """
+    Server-Sent Events variant of /analyze. Emits "raw_text",
+    "ingredients_detected" and one "explanation" per ingredient as each is
+    ready, then "result" with the same payload /analyze returns.
+    """
+    if not image.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid image file")
+
+    image_bytes = await image.read()
+
+    if not session_id or session_id == "null":
+        raise HTTPException(status_code=400, detail="Invalid Session ID")
+
+    if user_id == "null" or not user_id:
+        user_id = None
 
+    loop = asyncio.get_running_loop()
+
+    # Sync generator: Starlette runs it in the threadpool, so the blocking
+    # OCR / LLM / Supabase calls below never touch the event loop
+    def event_source():
+        save_user_upload(session_id, user_id)
+
+        events = get_pipeline().analyze_image_events(image_bytes, language=language, stream=True)
         try:
-             clean_json = raw_analysis
-             if "```json" in clean_json:
-                 clean_json = clean_json.replace("```json", "").replace("```", "")
-             elif "```" in clean_json:
-                 clean_json = clean_json.replace("```", "")
-
-             parsed = json.loads(clean_json)
-             if "results" in parsed and isinstance(parsed["results"], list):
-                 formatted_content = ""
-                 speech_content = ""
-                 suggested_ingredients = []
-
-                 for item in parsed["results"]:
-                     name = item.get('ingredient', 'Unknown')
-                     suggested_ingredients.append(name)    
-                     evidence = item.get('evidence', '')   
-                     explanation = item.get('explanation', '')
-                     safety = '⚠️ Caution' if 'risk' in evidence.lower() or 'unsafe' in evidence.lower() else '✅ Safe'
-
-                     formatted_content += f"### {name} {safety}\n{explanation}\n\n"
-                     clean_name = re.sub(r'\s*\(.*?\)', '', name)
-                     speech_content += f"{clean_name}. {explanation} "
-
-                 if "hi" in language.lower():
-                     formatted_content += "\n\n**क्या आप इननमें से किसी के बारे में और जानना चाहते हैं? बस माइक टैप करे            और पूछें!** 🎙️"
-                     speech_content += "क्या आप इनमें से कि   िसी के बारे में और जानना चाहते हैं? बस माइक टैप करें और पूछे           ।"
-                 else:
-                     formatted_content += "\n\n**Do you want to know more about any of these? Just tap the mic and ask!** 🎙️"
-                     speech_content += "Do you want to know more about any of these? Just tap the mic and ask."       
-
-                 result["speech"] = speech_content
-             else:
-                 # Localize fallback message if possible   
-                 msg = result.get("message", "Analysis complete but no ingredients identified.")
-
-                 # Handle specific error messages from pipeline
-                 if "better quality image" in msg:
-                    if "hi" in language.lower():
-                        msg = "कृपया थोड़ी बेहतर गुणवत्ता वाली इनज के साथ पुनः प्रयास करें।"
-                    else:
-                        msg = "Please try again with a better quality image."
-                 elif "No recognizable ingredients" in msg:
-                    if "hi" in language.lower():
-                        msg = "कोई पहचान योग्य सामग्री नहीं मिली।"
-
-                 formatted_content = msg
-                 result["speech"] = formatted_content      
+            while True:
+                try:
+                    event, data = next(events)
+                except StopIteration as stop:
+                    result = stop.value
+                    break
+                yield sse_event(event, data)
 
+            formatted_content = format_analysis(result, language)
+            if prefetch_tts:
+                # Runs on the event loop, where the TTS engine lives
+                loop.call_soon_threadsafe(tts_engine.prefetch, result["speech"], voice_id)
+            yield sse_event("result", {"success": True, "data": result})
+
+        except OCRBusyError as e:
+            yield sse_event("error", {"status": 503, "detail": str(e), "retry_after": e.retry_after})
+            return
+        except OCRTimeoutError as e:
+            yield sse_event("error", {"status": 504, "detail": str(e)})
+            return
         except Exception as e:
-             print(f"JSON formatting failed: {e}")
-             formatted_content = raw_analysis
-             # Ensure speech exists even on JSON parse failure
-             result["speech"] = "Analysis failed to parse."
-
-        # Fallback if speech is still missing (e.g. pipeline error with no message)
-        if "speech" not in result:
-             result["speech"] = result.get("error", "An unknown error occurred.")
-
-        assistant_message = {
-             "session_id": session_id,
-             "role": "assistant",
-             "content": formatted_content,
-             "source": "analysis_result"
-        }
-        if user_id:
-            assistant_message["user_id"] = user_id
+            import traceback
+            traceback.print_exc()
+            yield sse_event("error", {"status": 500, "detail": str(e)})
+            return
+
+        # Persist after the client already has the full result
+        try:
+            save_assistant_message(session_id, user_id, formatted_content)
+        except Exception as e:
+            print(f"Error saving analysis result: {e}")
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        supabase.table("messages").insert(assistant_message).execute()
 
-        # Update cleanup to be safe
-        if 'clean_json' in locals():
-            result["analysis"] = clean_json
-        else:
-            result["analysis"] = raw_analysis
+@router.post("/analyze/batch")
+async def analyze_batch(
+    images: List[UploadFile] = File(...),
+    product_ids: Optional[List[str]] = Form(None),
+    session_id: Optional[str] = Form(None),
+    user_id: Optional[str] = Form(None),
+    language: str = Form("en")
+):
+    """
+    Analyze several photos at once. `product_ids` (one per image) groups
+    images of the same product; without it all images are one product.
+    Returns one /analyze-style result per product, in first-seen order.
+    """
+    if not images:
+        raise HTTPException(status_code=400, detail="No images uploaded")
+    if len(images) > ANALYZE_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {ANALYZE_BATCH_MAX_IMAGES} images per batch")
+    if any(not image.content_type.startswith("image/") for image in images):
+        raise HTTPException(status_code=400, detail="Invalid image file")
+    if product_ids and len(product_ids) != len(images):
+        raise HTTPException(status_code=400, detail="product_ids must have one entry per image")
+
+    if session_id == "null":
+        session_id = None
+    if user_id == "null" or not user_id:
+        user_id = None
+
+    products = {}
+    for i, image in enumerate(images):
+        product_id = product_ids[i] if product_ids else "product"
+        products.setdefault(product_id, []).append(await image.read())
+
+    if session_id:
+        save_user_upload(session_id, user_id)
+
+    try:
+        loop = asyncio.get_running_loop()
+        func = functools.partial(get_pipeline().analyze_batch, list(products.values()), language=language)
+        results = await loop.run_in_executor(None, func)
+
+        data = []
+        for product_id, result in zip(products, results):
+            formatted_content = format_analysis(result, language)
+            if session_id:
+                save_assistant_message(session_id, user_id, formatted_content)
+            data.append({"product_id": product_id, "images": len(products[product_id]), **result})
 
         return {
             "success": True,
-            "data": result
+            "data": data
         }
 
+    except OCRBusyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except OCRTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
-        print(f"Error during analysis or result saving: {e}")
+        print(f"Error during batch analysis: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def process_analysis_job(job: dict, stages) -> dict:
+    """
+    Job queue processor: run the pipeline on a queued image, timing each
+    stage, and save the result to the session like /analyze does. LLM
+    failures and OCR overload raise RetryableJobError so the job is retried.
+    """
+    from services.pipeline import EXPLANATION_FAILED
+
+    params = job["params"]
+    language = params["language"]
+
+    stages.enter("ocr")
+    events = get_pipeline().analyze_image_events(job["image"], language=language)
+    try:
+        while True:
+            try:
+                event, _ = next(events)
+            except StopIteration as stop:
+                result = stop.value
+                break
+            if event == "raw_text":
+                stages.enter("retrieval")
+            elif event == "ingredients_detected":
+                stages.enter("explain")
+    except (OCRBusyError, OCRTimeoutError) as e:
+        raise RetryableJobError(str(e))
+
+    stages.enter("save")
+    formatted_content = format_analysis(result, language)
+    if result.get("error") == EXPLANATION_FAILED:
+        raise RetryableJobError(result["error"], result={"success": False, "data": result})
+
+    if params.get("session_id"):
+        save_assistant_message(params["session_id"], params.get("user_id"), formatted_content)
+
+    return {
+        "success": True,
+        "data": result
+    }
+
+
+@router.post("/analyze/jobs", status_code=202)
+async def submit_analysis_job(
+    image: UploadFile = File(...),
+    session_id: str = Form(...),
+    user_id: Optional[str] = Form(None),
+    language: str = Form("en")
+):
+    """
+    Queue an image for analysis and return at once with a job id. Poll
+    GET /analyze/jobs/{job_id} or subscribe to its /events stream.
+    """
+    if not image.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid image file")
+
+    image_bytes = await image.read()
+
+    if not session_id or session_id == "null":
+        raise HTTPException(status_code=400, detail="Invalid Session ID")
+
+    if user_id == "null" or not user_id:
+        user_id = None
+
+    save_user_upload(session_id, user_id)
+
+    params = {"session_id": session_id, "user_id": user_id, "language": language}
+    job_id = await asyncio.to_thread(job_queue.submit, params, image_bytes)
+
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status": "queued"
+    }
+
+
+@router.get("/analyze/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/analyze/jobs/{job_id}/events")
+async def analysis_job_events(job_id: str):
+    """
+    Server-Sent Events for one job: "status" whenever its status or attempt
+    count changes, then "result" with the finished job (same body as GET).
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_source():
+        current = job
+        last = None
+        while True:
+            state = (current["status"], current["attempts"])
+            if state != last:
+                last = state
+                yield sse_event("status", {"status": current["status"], "attempts": current["attempts"]})
+            if current["status"] in (DONE, FAILED):
+                yield sse_event("result", current)
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+            current = await asyncio.to_thread(job_queue.get, job_id)
+            if current is None:
+                yield sse_event("error", {"status": 404, "detail": "Job not found"})
+                return
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.websocket("/analyze/live")
+async def analyze_live(
+    websocket: WebSocket,
+    session_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    language: str = "en"
+):
+    """
+    Live mode: the client sends camera frames (binary JPEG messages) and
+    gets back a "frame" event per processed frame and an "explanation" per
+    newly explained ingredient. Text message {"type": "reset"} starts a new
+    product; {"type": "done"} sends the final "result" (saved to the session
+    like /analyze) and closes. Frames that arrive while one is being
+    processed replace each other, so only the latest is read.
+    """
+    from services.live_session import LiveSession
+
+    await websocket.accept()
+
+    if session_id == "null":
+        session_id = None
+    if user_id == "null" or not user_id:
+        user_id = None
+
+    live = LiveSession(await asyncio.to_thread(get_pipeline), language=language)
+    inbox = deque()  # ("frame", bytes) / (message type, None), in arrival order
+    arrived = asyncio.Event()
+    dropped = 0
+
+    async def receive():
+        nonlocal dropped
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("bytes") is not None:
+                    if inbox and inbox[-1][0] == "frame":
+                        # Superseded before it was read
+                        inbox.pop()
+                        dropped += 1
+                    inbox.append(("frame", message["bytes"]))
+                else:
+                    try:
+                        inbox.append((json.loads(message.get("text") or "{}").get("type"), None))
+                    except (ValueError, AttributeError):
+                        continue
+                arrived.set()
+        finally:
+            # However receiving stops (disconnect or error), the loop must wake up
+            inbox.append(("disconnect", None))
+            arrived.set()
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while True:
+            if not inbox:
+                arrived.clear()
+                await arrived.wait()
+                continue
+            kind, frame = inbox.popleft()
+
+            if kind == "disconnect":
+                # Re-raises whatever stopped the receiver, if it failed
+                await receiver
+                return
+
+            if kind == "reset":
+                live.reset()
+                await websocket.send_json({"event": "reset", "data": live.stats()})
+                continue
+
+            if kind == "done":
+                result = live.analysis()
+                formatted_content = format_analysis(result, language)
+                if session_id:
+                    try:
+                        await asyncio.to_thread(save_user_upload, session_id, user_id)
+                        await asyncio.to_thread(save_assistant_message, session_id, user_id, formatted_content)
+                    except Exception as e:
+                        print(f"Error saving live result: {e}")
+                await websocket.send_json({
+                    "event": "result",
+                    "data": {"success": True, "data": result, "stats": {**live.stats(), "dropped_frames": dropped}}
+                })
+                await websocket.close()
+                return
+
+            if kind != "frame":
+                continue
+            if len(frame) > LIVE_MAX_FRAME_BYTES:
+                await websocket.send_json({"event": "error", "data": {"status": 413, "detail": "Frame too large"}})
+                continue
+
+            try:
+                summary = await asyncio.to_thread(live.add_frame, frame)
+                await websocket.send_json({"event": "frame", "data": summary})
+
+                # Only once the confirmed set is stable, and only its new members
+                for explanation in await asyncio.to_thread(live.explain_pending):
+                    await websocket.send_json({"event": "explanation", "data": explanation})
+
+            except OCRBusyError as e:
+                await websocket.send_json({"event": "error", "data": {"status": 503, "detail": str(e), "retry_after": e.retry_after}})
+            except OCRTimeoutError as e:
+                await websocket.send_json({"event": "error", "data": {"status": 504, "detail": str(e)}})
+            except Exception as e:
+                print(f"Live frame failed: {e}")
+                await websocket.send_json({"event": "error", "data": {"status": 500, "detail": str(e)}})
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
@@ -2,23 +2,46 @@ from fastapi import APIRouter, HTTPException, Body
 from pydantic import BaseModel
 from typing import Optional, List
 from database import supabase
-from services.rag_engine import RAGEngine
+from services.message_store import save_message, message_writer
+from services.history_cache import session_history
+import asyncio
+from services.engine_registry import aget_rag_engine
 
 router = APIRouter()
-rag = RAGEngine()
 
 class ChatMessage(BaseModel):
     session_id: str
     message: str
     user_id: Optional[str] = None
 
+def fetch_recent_history(session_id: str) -> List[dict]:
+    # Last 10 messages for context
+    history_response = supabase.table("messages")\
+        .select("role, content")\
+        .eq("session_id", session_id)\
+        .order("created_at", desc=True)\
+        .limit(10)\
+        .execute()
+
+    # Convert to list and reverse to get chronological order [oldest ... newest]
+    return history_response.data[::-1] if history_response.data else []
+
 @router.post("/message")
 async def chat_message(data: ChatMessage):
     """
     Handle a user message: save it, get AI response with history, save AI response.
     """
     try:
-        # 1. Save User Message
+        # 1. History from the session ring buffer; database only on a cold miss.
+        # Loaded before saving the new message so it is not counted twice.
+        history = session_history.get(data.session_id)
+        if history is None:
+            # Messages still in the write-behind queue are not in the table yet
+            await asyncio.to_thread(message_writer.flush, data.session_id)
+            history = await asyncio.to_thread(fetch_recent_history, data.session_id)
+            session_history.put(data.session_id, history)
+
+        # 2. Save User Message
         user_msg = {
             "session_id": data.session_id,
             "role": "user",
@@ -28,21 +51,12 @@ async def chat_message(data: ChatMessage):
         if data.user_id:
             user_msg["user_id"] = data.user_id
 
-        supabase.table("messages").insert(user_msg).execute()
-
-        # 2. Fetch History (last 10 messages for context)  
-        history_response = supabase.table("messages")\
-            .select("role, content")\
-            .eq("session_id", data.session_id)\
-            .order("created_at", desc=True)\
-            .limit(10)\
-            .execute()
-
-        # Convert to list and reverse to get chronological order [oldest ... newest]
-        history = history_response.data[::-1] if history_response.data else []
+        save_message(user_msg)
+        history = history + [{"role": "user", "content": data.message}]
 
         # 3. Generate AI Response
-        ai_response_text = rag.chat_completion(history, data.message)
+        rag = await aget_rag_engine()
+        ai_response_text = await rag.achat_completion(history, data.message)
 
         # 4. Save AI Message
         ai_msg = {
@@ -54,7 +68,7 @@ async def chat_message(data: ChatMessage):
         if data.user_id:
             ai_msg["user_id"] = data.user_id
 
-        supabase.table("messages").insert(ai_msg).execute()
+        save_message(ai_msg)
 
         return {
             "role": "assistant",
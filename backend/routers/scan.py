@@ -1,6 +1,7 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
 import asyncio
 from services.ocr import extract_text_from_image
+from services.ocr_engine import OCRBusyError, OCRTimeoutError
 from services.extractor import extract_ingredients
 
 router = APIRouter()
@@ -24,5 +25,13 @@ async def scan_image(image: UploadFile = File(...)):
             "ingredients": ingredients
         }
 
+    except OCRBusyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except OCRTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
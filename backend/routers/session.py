@@ -3,10 +3,10 @@ from pydantic import BaseModel
 from typing import Optional, List
 from database import supabase
 import uuid
-from services.rag_engine import RAGEngine
+from services.engine_registry import aget_rag_engine
+from services.history_cache import session_history
 
 router = APIRouter()
-rag = RAGEngine()
 
 class CreateSessionRequest(BaseModel):
     user_id: Optional[str] = None
@@ -29,6 +29,9 @@ async def delete_sessions(request: DeleteSessionsRequest):
             .eq("user_id", request.user_id)\
             .execute()
 
+        for session in response.data:
+            session_history.invalidate(session["id"])
+
         return {"success": True, "count": len(response.data)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -39,7 +42,8 @@ async def update_session_title(session_id: str, text: str = Body(..., embed=True
     Generate and update title for a session based on user text.
     """
     try:
-        title = rag.generate_title(text)
+        rag = await aget_rag_engine()
+        title = await rag.agenerate_title(text)
 
         # Update session in Supabase
 
@@ -0,0 +1,80 @@
+from collections import deque
+from typing import Any, Iterable, Iterator, List, Tuple
+
+
+class Automaton:
+    """
+    Aho-Corasick automaton: finds every occurrence of every pattern in one
+    left-to-right pass over the text, however many patterns there are.
+
+        matcher = Automaton([("sait", "Salt"), ("nergy", None)])
+        for start, end, value in matcher.finditer("sea sait"):
+            ...
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]] = ()):
+        self._goto = [{}]      # node -> {char: node}
+        self._fail = [0]
+        self._out = [[]]       # node -> [(pattern length, value)]
+        self._built = False
+        self.size = 0
+        for pattern, value in patterns:
+            self.add(pattern, value)
+        self.build()
+
+    def add(self, pattern: str, value: Any = None):
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(pattern), value))
+        self.size += 1
+        self._built = False
+
+    def build(self):
+        """Compute failure links (breadth first) and merge suffix outputs."""
+        queue = deque(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+                queue.append(nxt)
+        self._built = True
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Yield (start, end, value) for every match, ordered by end position."""
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, value in out[node]:
+                yield i + 1 - length, i + 1, value
+
+    def findall(self, text: str) -> List[Tuple[int, int, Any]]:
+        return list(self.finditer(text))
+
+    def search(self, text: str) -> bool:
+        """True if any pattern occurs in text (stops at the first match)."""
+        for _ in self.finditer(text):
+            return True
+        return False
@@ -0,0 +1,123 @@
+import os
+import hashlib
+import threading
+from typing import Optional
+
+from services.cache import LRUCache
+from services.knowledge_loader import BASE_DIR
+
+TTS_MEMORY_CACHE_SIZE = int(os.getenv("TTS_MEMORY_CACHE_SIZE", "256"))
+TTS_DISK_CACHE_DIR = os.getenv(
+    "TTS_DISK_CACHE_DIR",
+    os.path.join(BASE_DIR, ".cache", "tts")
+)
+TTS_DISK_CACHE_MB = int(os.getenv("TTS_DISK_CACHE_MB", "512"))
+
+PRUNE_EVERY = 50  # disk writes between size checks
+
+
+def audio_cache_key(text: str, voice: str, provider: str, audio_format: str) -> str:
+    raw = "\x1f".join((provider, voice, audio_format, text.strip()))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """
+    Content-addressed synthesized audio: an in-memory LRU in front of an
+    on-disk store that survives restarts and is shared by workers.
+    Blocking (disk I/O); async callers should use asyncio.to_thread.
+    """
+
+    def __init__(self, memory_items: int = TTS_MEMORY_CACHE_SIZE,
+                 disk_dir: Optional[str] = TTS_DISK_CACHE_DIR,
+                 disk_max_bytes: int = TTS_DISK_CACHE_MB * 1024 * 1024):
+        self.memory = LRUCache(maxsize=memory_items)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.mp3")
+
+    def get(self, key: str) -> Optional[bytes]:
+        audio = self.memory.get(key)
+        if audio is not None:
+            return audio
+
+        if self.disk_dir:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    audio = f.read()
+                os.utime(path)  # mtime doubles as last-used time for pruning
+                self.disk_hits += 1
+                self.memory.set(key, audio)
+                return audio
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[WARNING] Audio cache read failed: {e}")
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, audio: bytes):
+        if not audio:
+            return
+        self.memory.set(key, audio)
+
+        if not self.disk_dir:
+            return
+        try:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(audio)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[WARNING] Audio cache write failed: {e}")
+            return
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Delete least recently used files until the disk store fits its budget."""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        total = memory["hits"] + self.disk_hits + self.misses
+        return {
+            "memory": memory,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((memory["hits"] + self.disk_hits) / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+
+# Process-wide singletons. Routers and the pipeline share one RAGEngine
+# (and therefore one SentenceTransformer + FAISS index) per worker.
+_rag_engine = None
+_explanation_store = None
+_lock = threading.Lock()
+
+_state = {
+    "status": "cold",      # cold -> loading -> ready | failed
+    "error": None,
+    "load_seconds": None,
+}
+
+
+def get_rag_engine():
+    """
+    Return the shared RAGEngine, building it on first use.
+    Safe to call from the event loop thread and from executor threads.
+    """
+    global _rag_engine
+    if _rag_engine is not None:
+        return _rag_engine
+
+    with _lock:
+        if _rag_engine is None:
+            _state["status"] = "loading"
+            start = time.perf_counter()
+            try:
+                from services.rag_engine import RAGEngine
+                _rag_engine = RAGEngine()
+            except Exception as e:
+                _state["status"] = "failed"
+                _state["error"] = str(e)
+                raise
+            _state["status"] = "ready"
+            _state["error"] = None
+            _state["load_seconds"] = round(time.perf_counter() - start, 2)
+            print(f"[INFO] RAGEngine ready in {_state['load_seconds']}s")
+    return _rag_engine
+
+
+async def aget_rag_engine():
+    """
+    get_rag_engine for async routes: if the engine is still loading, wait
+    for it in a worker thread instead of blocking the event loop.
+    """
+    if _rag_engine is not None:
+        return _rag_engine
+    return await asyncio.to_thread(get_rag_engine)
+
+
+async def shutdown():
+    if _rag_engine is not None:
+        await _rag_engine.aclose()
+
+
+def get_explanation_store():
+    global _explanation_store
+    if _explanation_store is None:
+        with _lock:
+            if _explanation_store is None:
+                from services.explanation_store import ExplanationStore
+                _explanation_store = ExplanationStore()
+    return _explanation_store
+
+
+def warmup_in_background() -> threading.Thread:
+    """
+    Start loading the shared engine on a daemon thread so the server can
+    accept connections while the embedding model and index are built.
+    """
+    def _run():
+        try:
+            get_rag_engine()
+        except Exception as e:
+            print(f"[ERROR] RAGEngine warmup failed: {e}")
+
+    thread = threading.Thread(target=_run, name="rag-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def is_ready() -> bool:
+    return _rag_engine is not None
+
+
+def readiness() -> dict:
+    state = dict(_state)
+    if _rag_engine is not None:
+        state["query_embedding_cache"] = _rag_engine.vector_store.query_cache.stats()
+        state["retrieval"] = dict(_rag_engine.retrieval_stats)
+        state["llm_coalescing"] = {
+            "threads": _rag_engine.inflight.stats(),
+            "async": _rag_engine.async_inflight.stats(),
+        }
+        state["chat_cache"] = _rag_engine.chat_cache.stats()
+    if _explanation_store is not None:
+        state["explanation_store"] = _explanation_store.stats()
+    return state
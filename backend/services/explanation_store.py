@@ -0,0 +1,90 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from services.knowledge_loader import BASE_DIR
+
+EXPLANATION_STORE_PATH = os.getenv(
+    "EXPLANATION_STORE_PATH",
+    os.path.join(BASE_DIR, "data", "explanations.db")
+)
+
+
+def document_hash(doc: Dict) -> str:
+    """Stable hash of a knowledge document; edits to the doc invalidate its entries."""
+    raw = json.dumps(doc, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def normalize_language(language: str) -> str:
+    language = (language or "en").lower()
+    return "hi" if "hi" in language else "en"
+
+
+class ExplanationStore:
+    """
+    Persistent (doc hash, ingredient, language) -> explanation entries.
+    Lets the pipeline skip the LLM for ingredients it has explained before.
+    """
+
+    def __init__(self, path: str = EXPLANATION_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS explanations (
+                doc_hash TEXT NOT NULL,
+                ingredient TEXT NOT NULL,
+                language TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (doc_hash, ingredient, language)
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, doc: Dict, language: str) -> Optional[Dict]:
+        key = (document_hash(doc), doc["ingredient"], normalize_language(language))
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM explanations WHERE doc_hash = ? AND ingredient = ? AND language = ?",
+                key
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, doc: Dict, language: str, result: Dict):
+        key = (document_hash(doc), doc["ingredient"], normalize_language(language))
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO explanations (doc_hash, ingredient, language, result) VALUES (?, ?, ?, ?)",
+                key + (json.dumps(result, ensure_ascii=False),)
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM explanations").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
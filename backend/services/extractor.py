@@ -1,21 +1,36 @@
 import re
+from services.aho_corasick import Automaton
+from services.knowledge_loader import load_lexicon
 from services.normalizer import normalize_ingredient
 
-COMMON_FOOD_WORDS = [
-    "sugar", "salt", "flour", "oil", "milk", "egg", "butter",
-    "wheat", "cocoa", "starch", "syrup", "flavour", "flavor",
-    "protein", "fat", "carbohydrate", "vitamin", "acid", "water", 
-    "corn", "soy", "nut", "fruit", "juice", "extract", "ghee", "masala"
-]
+COMMON_FOOD_WORDS = load_lexicon("food_words.json", [])
+
+# Any food word anywhere in the text, found in a single pass
+_FOOD_WORDS = Automaton((word.lower(), None) for word in COMMON_FOOD_WORDS)
 
 def looks_like_ingredients(text: str) -> bool:
-    text = text.lower()
-    return any(word in text for word in COMMON_FOOD_WORDS)
+    return _FOOD_WORDS.search(text.lower())
+
+
+# E-number / INS codes survive cleaning so the lexical index can resolve them
+E_NUMBER_RE = re.compile(r"\b(e|ins)\s*-?\s*(\d{3,4}[a-z]?)\b", re.IGNORECASE)
+
+# Compiled once at import; clean_item runs for every item of every label
+BRACKETS_RE = re.compile(r"\([^)]*\)")
+DIGITS_RE = re.compile(r"\d")
+SYMBOLS_RE = re.compile(r"[^a-zA-Z0-9\s]")
+INGREDIENTS_RE = re.compile(r"ingredients[:\-]?(.*)")
+ITEM_SPLIT_RE = re.compile(r",|;")
 
 
 def clean_item(item: str) -> str:
-    item = re.sub(r"\([^)]*\)", "", item)      # remove brackets
-    item = re.sub(r"[^a-zA-Z\s]", "", item)    # remove symbols
+    item = BRACKETS_RE.sub("", item)           # remove brackets
+    item = E_NUMBER_RE.sub(r"\1\2", item)      # "ins 330" -> "ins330"
+    item = " ".join(
+        tok if E_NUMBER_RE.fullmatch(tok) else DIGITS_RE.sub("", tok)
+        for tok in item.split()
+    )
+    item = SYMBOLS_RE.sub("", item)            # remove symbols
     item = item.strip()
     return item.title()
 
@@ -24,7 +39,7 @@ def extract_ingredients(text: str) -> list[str]:
     text = text.lower()
 
     # 1️Try "ingredients" keyword
-    match = re.search(r"ingredients[:\-]?(.*)", text)
+    match = INGREDIENTS_RE.search(text)
     if match:
         ingredients_text = match.group(1)
     else:
@@ -34,7 +49,7 @@ def extract_ingredients(text: str) -> list[str]:
         ingredients_text = text
 
     # Split by commas
-    raw_items = re.split(r",|;", ingredients_text)
+    raw_items = ITEM_SPLIT_RE.split(ingredients_text)
 
     cleaned = []
     for item in raw_items:
@@ -0,0 +1,95 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import List, Dict, Optional
+
+HISTORY_SIZE = int(os.getenv("HISTORY_SIZE", "10"))  # Same window the chat route fetched
+HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "5000"))
+HISTORY_TTL = float(os.getenv("HISTORY_TTL", "1800"))
+
+
+class SessionHistoryCache:
+    """
+    Per-session ring buffer of the most recent messages.
+    Sessions expire after HISTORY_TTL seconds idle; beyond
+    HISTORY_MAX_SESSIONS the least recently used session is dropped.
+    """
+
+    def __init__(self, size: int = HISTORY_SIZE, max_sessions: int = HISTORY_MAX_SESSIONS,
+                 ttl: float = HISTORY_TTL):
+        self.size = size
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session_id -> (deque, last_used)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _live(self, session_id: str):
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.ttl:
+            del self._sessions[session_id]
+            self.evictions += 1
+            return None
+        return entry[0]
+
+    def _touch(self, session_id: str, buffer: deque):
+        self._sessions[session_id] = (buffer, time.monotonic())
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, session_id: str) -> Optional[List[Dict]]:
+        """Chronological history, or None on a cold miss."""
+        with self._lock:
+            buffer = self._live(session_id)
+            if buffer is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touch(session_id, buffer)
+            return list(buffer)
+
+    def put(self, session_id: str, messages: List[Dict]):
+        """Seed a session from the database after a cold miss."""
+        buffer = deque(
+            ({"role": m["role"], "content": m["content"]} for m in messages),
+            maxlen=self.size
+        )
+        with self._lock:
+            self._touch(session_id, buffer)
+
+    def append(self, session_id: str, message: Dict):
+        """
+        Record a new message. Cold sessions are left alone: a partial buffer
+        would hide older history that only the database has.
+        """
+        with self._lock:
+            buffer = self._live(session_id)
+            if buffer is None:
+                return
+            buffer.append({"role": message["role"], "content": message["content"]})
+            self._touch(session_id, buffer)
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+session_history = SessionHistoryCache()
@@ -0,0 +1,100 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from PIL import Image
+
+HASH_SIZE = 8  # 8x8 difference hash -> 64 bits
+
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "512"))
+# Max differing bits for two frames of one live session to count as the same view
+IMAGE_HASH_TOLERANCE = int(os.getenv("IMAGE_HASH_TOLERANCE", "4"))
+
+
+def perceptual_hash(image_bytes: bytes) -> int:
+    """
+    Difference hash of the downscaled grayscale image.
+    Robust to re-encoding, small shifts and exposure changes between frames.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    # JPEG decoders can downscale while decoding, which is much cheaper
+    image.draft("L", (HASH_SIZE * 16, HASH_SIZE * 16))
+    image = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR)
+
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def image_fingerprint(image_bytes: bytes) -> Tuple[str, Optional[int]]:
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    try:
+        phash = perceptual_hash(image_bytes)
+    except Exception:
+        # Undecodable images still get exact-match caching
+        phash = None
+    return digest, phash
+
+
+class ImageResultCache:
+    """
+    Size-bounded LRU keyed by the exact image bytes. There is no perceptual
+    fallback: a 64-bit dHash cannot see label text, so two similar packs
+    would get each other's ingredients.
+    """
+
+    def __init__(self, maxsize: int = IMAGE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # (digest, variant) -> value
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, fingerprint: Tuple[str, Optional[int]], variant: str = "") -> Any:
+        key = (fingerprint[0], variant)
+
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+
+            self.misses += 1
+            return None
+
+    def set(self, fingerprint: Tuple[str, Optional[int]], value: Any, variant: str = ""):
+        if self.maxsize <= 0:
+            return
+        key = (fingerprint[0], variant)
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+# Process-wide caches in front of OCR and the full analysis pipeline
+ocr_cache = ImageResultCache()
+analysis_cache = ImageResultCache()
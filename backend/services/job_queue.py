@@ -0,0 +1,373 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional
+
+from services.knowledge_loader import BASE_DIR
+from services.ocr_engine import OCR_WORKERS
+
+JOB_STORE_PATH = os.getenv(
+    "JOB_STORE_PATH",
+    os.path.join(BASE_DIR, "data", "jobs.db")
+)
+# "sqlite" (durable, shared by every worker process) or "memory" (tests)
+JOB_BACKEND = os.getenv("JOB_BACKEND", "sqlite")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # pipeline threads per process
+JOB_OCR_CONCURRENCY = int(os.getenv("JOB_OCR_CONCURRENCY", str(OCR_WORKERS)))
+JOB_LLM_CONCURRENCY = int(os.getenv("JOB_LLM_CONCURRENCY", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))  # then a running job is retaken
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+JOB_POLL_INTERVAL = 1.0  # idle workers also check for jobs queued by other processes
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class RetryableJobError(RuntimeError):
+    """Transient failure (LLM timeout, OCR overload): run the job again later."""
+
+    def __init__(self, message: str, result: Optional[Dict] = None):
+        super().__init__(message)
+        self.result = result
+
+
+class SQLiteJobStore:
+    """
+    Jobs table in a local SQLite file. Claims are atomic across threads and
+    processes, so several uvicorn workers can consume the same queue.
+    """
+
+    def __init__(self, path: str = JOB_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                image BLOB,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                timings TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                lease_until REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at)")
+
+    def insert(self, job_id: str, params: Dict, image: bytes):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, params, image, created_at, updated_at, available_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(params), image, now, now, now)
+            )
+
+    def claim(self, lease: float = JOB_LEASE_SECONDS,
+              max_attempts: int = JOB_MAX_ATTEMPTS) -> Optional[Dict]:
+        """
+        Take the oldest runnable job (or one whose worker died) and mark it
+        running. A job whose worker died on its last allowed attempt is
+        failed instead: it may be what kills the worker.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ?, lease_until = NULL, image = NULL "
+                    "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (FAILED, "Worker stopped while running the job", now, RUNNING, now, max_attempts)
+                )
+                row = self._conn.execute(
+                    "SELECT id, params, image, attempts, created_at FROM jobs "
+                    "WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_until < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, now, RUNNING, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?, lease_until = ? "
+                    "WHERE id = ?",
+                    (RUNNING, now, now + lease, row[0])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        return {
+            "id": row[0],
+            "params": json.loads(row[1]),
+            "image": row[2],
+            "attempts": row[3] + 1,
+            "created_at": row[4],
+        }
+
+    def renew(self, job_id: str, lease: float = JOB_LEASE_SECONDS):
+        """Push back the lease of a job that is still running."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ?",
+                (time.time() + lease, job_id, RUNNING)
+            )
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict], error: Optional[str],
+                timings: Dict, available_at: Optional[float] = None):
+        now = time.time()
+        keep_image = status == QUEUED  # Needed again for the retry
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, timings = ?, updated_at = ?, "
+                "available_at = COALESCE(?, available_at), lease_until = NULL"
+                + ("" if keep_image else ", image = NULL")
+                + " WHERE id = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, json.dumps(timings), now, available_at, job_id)
+            )
+
+    def complete(self, job_id: str, result: Dict, timings: Dict):
+        self._finish(job_id, DONE, result, None, timings)
+
+    def fail(self, job_id: str, error: str, timings: Dict, result: Optional[Dict] = None):
+        self._finish(job_id, FAILED, result, error, timings)
+
+    def retry(self, job_id: str, error: str, timings: Dict, delay: float):
+        self._finish(job_id, QUEUED, None, error, timings, available_at=time.time() + delay)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, attempts, result, error, timings, created_at, updated_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "attempts": row[2],
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4],
+            "timings": json.loads(row[5]) if row[5] else {},
+            "created_at": row[6],
+            "updated_at": row[7],
+        }
+
+    def prune(self, older_than: float = JOB_RETENTION_SECONDS):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, time.time() - older_than)
+            )
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+class InMemoryJobStore(SQLiteJobStore):
+    """Same store on a private in-memory database (nothing survives a restart)."""
+
+    def __init__(self):
+        super().__init__(":memory:")
+
+
+class StageTimer:
+    """
+    Times the stages of one job. Entering a stage that has a limit waits
+    for a slot first, so at most N jobs per process run OCR (or the LLM)
+    at once and the rest queue in order instead of contending. `renew` is
+    called at every stage start to extend the job's lease.
+    """
+
+    def __init__(self, limits: Dict[str, threading.BoundedSemaphore],
+                 renew: Optional[Callable[[], None]] = None):
+        self.limits = limits
+        self.renew = renew
+        self.timings = {}
+        self._stage = None
+        self._started = None
+
+    def enter(self, stage: Optional[str]):
+        self.close()
+        if stage is None:
+            return
+        slot = self.limits.get(stage)
+        if slot is not None:
+            waited = time.perf_counter()
+            slot.acquire()
+            self.timings[f"{stage}_wait"] = round(time.perf_counter() - waited, 3)
+        if self.renew is not None:
+            try:
+                self.renew()
+            except Exception as e:
+                print(f"[WARNING] Job lease renewal failed: {e}")
+        self._stage = stage
+        self._started = time.perf_counter()
+
+    def close(self):
+        if self._stage is None:
+            return
+        self.timings[self._stage] = round(time.perf_counter() - self._started, 3)
+        slot = self.limits.get(self._stage)
+        if slot is not None:
+            slot.release()
+        self._stage = None
+
+
+class JobQueue:
+    """
+    Durable analysis job queue. Requests enqueue the image and return a job
+    id; JOB_WORKERS threads claim jobs from the store and run `processor`
+    on them. Transient failures are retried with backoff up to
+    JOB_MAX_ATTEMPTS; jobs of a crashed worker are retaken once their lease
+    expires (and failed once they used up their attempts). The lease is
+    renewed at every stage, so only a single stage running longer than
+    JOB_LEASE_SECONDS gets the job run twice.
+    """
+
+    def __init__(self, store=None, workers: int = JOB_WORKERS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self._store = store
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.limits = {
+            "ocr": threading.BoundedSemaphore(JOB_OCR_CONCURRENCY),
+            "explain": threading.BoundedSemaphore(JOB_LLM_CONCURRENCY),
+        }
+
+        self._processor = None
+        self._threads: List[threading.Thread] = []
+        self._cond = threading.Condition()
+        self._stopping = False
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    @property
+    def store(self):
+        # Opened on first use so importing this module creates no files
+        if self._store is None:
+            self._store = InMemoryJobStore() if JOB_BACKEND == "memory" else SQLiteJobStore()
+        return self._store
+
+    def start(self, processor: Callable[[Dict, StageTimer], Dict]):
+        if self._threads:
+            return
+        self._processor = processor
+        self._stopping = False
+        self.store.prune()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"analysis-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, params: Dict, image: bytes) -> str:
+        job_id = str(uuid.uuid4())
+        self.store.insert(job_id, params, image)
+        self.submitted += 1
+        with self._cond:
+            self._cond.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.store.get(job_id)
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                job = self.store.claim(max_attempts=self.max_attempts)
+            except Exception as e:
+                print(f"[ERROR] Job claim failed: {e}")
+                job = None
+
+            if job is None:
+                with self._cond:
+                    if not self._stopping:
+                        self._cond.wait(JOB_POLL_INTERVAL)
+                continue
+
+            self._execute(job)
+
+    def _execute(self, job: Dict):
+        stages = StageTimer(self.limits, renew=lambda: self.store.renew(job["id"]))
+        stages.timings["queued"] = round(max(0.0, time.time() - job["created_at"]), 3)
+        started = time.perf_counter()
+
+        try:
+            result = self._processor(job, stages)
+        except RetryableJobError as e:
+            stages.close()
+            stages.timings["total"] = round(time.perf_counter() - started, 3)
+            if job["attempts"] < self.max_attempts:
+                delay = min(2 ** job["attempts"], 30)
+                self.retried += 1
+                print(f"[WARNING] Job {job['id']} attempt {job['attempts']} failed, retrying in {delay}s: {e}")
+                self.store.retry(job["id"], str(e), stages.timings, delay)
+            else:
+                self.failed += 1
+                self.store.fail(job["id"], str(e), stages.timings, e.result)
+            return
+        except Exception as e:
+            stages.close()
+            stages.timings["total"] = round(time.perf_counter() - started, 3)
+            self.failed += 1
+            print(f"[ERROR] Job {job['id']} failed: {e}")
+            self.store.fail(job["id"], str(e), stages.timings)
+            return
+
+        stages.close()
+        stages.timings["total"] = round(time.perf_counter() - started, 3)
+        self.completed += 1
+        self.store.complete(job["id"], result, stages.timings)
+
+    def shutdown(self, timeout: Optional[float] = 10.0):
+        """Stop claiming jobs; running ones finish (or are retaken after their lease)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self) -> dict:
+        try:
+            counts = self._store.counts() if self._store is not None else {}
+        except Exception:
+            counts = {}
+        return {
+            "workers": len(self._threads),
+            "ocr_concurrency": JOB_OCR_CONCURRENCY,
+            "llm_concurrency": JOB_LLM_CONCURRENCY,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "by_status": counts,
+        }
+
+
+job_queue = JobQueue()
@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 from typing import List, Dict
 
 BASE_DIR = os.path.abspath(
@@ -8,6 +9,9 @@ BASE_DIR = os.path.abspath(
 
 KNOWLEDGE_DIR = os.path.join(BASE_DIR, "knowledge")
 
+# Word lists for ingredient extraction (OCR corrections, stopwords, food words)
+LEXICON_DIR = os.getenv("LEXICON_DIR", os.path.join(BASE_DIR, "lexicon"))
+
 REQUIRED_FIELDS = {
     "ingredient",
     "role",
@@ -23,7 +27,8 @@ def load_knowledge() -> List[Dict]:
     if not os.path.exists(KNOWLEDGE_DIR):
         raise FileNotFoundError(f"Knowledge directory not found: {KNOWLEDGE_DIR}")
 
-    for filename in os.listdir(KNOWLEDGE_DIR):
+    # Sorted so document order (and therefore index ids) is stable across boots
+    for filename in sorted(os.listdir(KNOWLEDGE_DIR)):
         if not filename.endswith(".json"):
             continue
 
@@ -48,3 +53,33 @@ def load_knowledge() -> List[Dict]:
     print(f"[INFO] Loaded {len(documents)} knowledge documents")
     return documents
 
+
+def knowledge_fingerprint() -> str:
+    """
+    SHA-256 over the names and raw bytes of every knowledge JSON file.
+    Changes whenever a document is added, removed or edited.
+    """
+    digest = hashlib.sha256()
+
+    for filename in sorted(os.listdir(KNOWLEDGE_DIR)):
+        if not filename.endswith(".json"):
+            continue
+
+        digest.update(filename.encode("utf-8"))
+        with open(os.path.join(KNOWLEDGE_DIR, filename), "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def load_lexicon(filename: str, default):
+    """Load one JSON file from LEXICON_DIR, or `default` if it is missing or invalid."""
+    file_path = os.path.join(LEXICON_DIR, filename)
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"[WARNING] Lexicon file not found: {file_path}")
+    except json.JSONDecodeError:
+        print(f"[ERROR] Invalid JSON in {filename}")
+    return default
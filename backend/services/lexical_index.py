@@ -0,0 +1,170 @@
+import re
+from typing import List, Dict, Optional, Set, Tuple
+
+from services.knowledge_loader import load_lexicon
+from services.typo_index import SymSpellIndex, edit_distance, max_distance_for
+
+# "E 621", "e-621", "INS 621", "ins621" -> "e621"
+E_NUMBER_RE = re.compile(r"\b(?:e|ins)\s*-?\s*(\d{3,4}[a-z]?)\b")
+
+SPELLING_VARIANTS = {
+    "flavour": "flavor",
+    "colour": "color",
+    "iodised": "iodized",
+    "soya": "soy",
+}
+
+# A known word plus one of these is another word ("salty"), not OCR noise
+DERIVED_SUFFIXES = ("y", "ed", "er", "ing", "ic", "ish", "ly", "ous")
+
+
+def lexical_key(name: str) -> str:
+    """
+    Canonical lookup key: lowercase, punctuation stripped, E/INS numbers
+    collapsed and British spellings folded.
+    """
+    n = name.lower()
+    n = re.sub(r"[^a-z0-9\s]", " ", n)
+    n = E_NUMBER_RE.sub(r"e\1", n)
+
+    tokens = [SPELLING_VARIANTS.get(t, t) for t in n.split()]
+    return " ".join(tokens)
+
+
+def _variants(key: str) -> List[str]:
+    # Near-exact forms: without spaces, and with a trailing plural dropped
+    variants = [key, key.replace(" ", "")]
+    if key.endswith("s") and len(key) > 3:
+        variants.append(key[:-1])
+    return variants
+
+
+class LexicalIndex:
+    """
+    Exact/alias lookup over the knowledge documents.
+    Resolves names like "MSG", "E621" or "INS 330" without the embedding model.
+    correct() also resolves OCR-damaged names ("sodum benzoate") through a
+    symmetric-delete spelling index over the same vocabulary.
+    """
+
+    def __init__(self, documents: List[Dict], lexicon: Optional[List[str]] = None):
+        self._index = {}
+        # Word-level vocabulary: knowledge names and aliases, plus common
+        # ingredient words so a valid word ("malt") is never "fixed" into a
+        # knowledge word ("salt")
+        self.spelling = SymSpellIndex()
+        # Whole names without spaces, for damage that splits or joins words
+        self._compact = SymSpellIndex()
+        # Entries of the two indexes that come from knowledge names; the
+        # rest are lexicon-only words a typo may just as well belong to
+        self._knowledge_words: Set[str] = set()
+        self._knowledge_compact: Set[str] = set()
+        self.corrections = 0
+
+        if lexicon is None:
+            lexicon = load_lexicon("ingredients.json", [])
+        for name in lexicon:
+            name_key = lexical_key(name)
+            for token in name_key.split():
+                self.spelling.add(token)
+            if name_key and not any(c.isdigit() for c in name_key):
+                self._compact.add(name_key.replace(" ", ""))
+
+        for doc in documents:
+            names = [doc["ingredient"]] + list(doc.get("aliases", []))
+            for name in names:
+                name_key = lexical_key(name)
+                for token in name_key.split():
+                    self.spelling.add(token, weight=2)
+                    self._knowledge_words.add(token)
+                if not any(c.isdigit() for c in name_key):
+                    compact = name_key.replace(" ", "")
+                    self._compact.add(compact)
+                    self._knowledge_compact.add(compact)
+
+                for key in _variants(name_key):
+                    if not key:
+                        continue
+                    existing = self._index.get(key)
+                    if existing is not None and existing is not doc:
+                        print(f"[WARNING] Alias '{name}' maps to both {existing['ingredient']} and {doc['ingredient']}")
+                        continue
+                    self._index[key] = doc
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def lookup(self, name: str) -> Optional[Dict]:
+        for key in _variants(lexical_key(name)):
+            doc = self._index.get(key)
+            if doc is not None:
+                return doc
+        return None
+
+    @staticmethod
+    def _misread(word: str, candidate: str, distance: int) -> bool:
+        """
+        Whether `word` looks like OCR damage of `candidate`: only letters OCR
+        confuses are swapped and no word ending was added. "Sodium Nitrite"
+        is another chemical, not a misread Sodium Citrate.
+        """
+        if word.startswith(candidate) and word[len(candidate):] in DERIVED_SUFFIXES:
+            return False
+        return edit_distance(word, candidate, distance, confusable_only=True) <= distance
+
+    @classmethod
+    def _guarded(cls, index: SymSpellIndex, knowledge: Set[str], word: str,
+                 max_distance: Optional[int] = None) -> Optional[Tuple[str, int]]:
+        """
+        index.lookup(), except that a knowledge word is only chosen when the
+        word looks like a misread of it, and not when a lexicon-only word is
+        at least as close: "sucrlose" is sucralose misread, not sucrose.
+        """
+        hit = index.lookup(word, max_distance)
+        if hit is None or hit[1] == 0 or hit[0] not in knowledge:
+            return hit
+        if not cls._misread(word, *hit):
+            return None
+        for candidate, distance in index.candidates(word, max_distance):
+            if distance > hit[1]:
+                break
+            if candidate not in knowledge:
+                return None
+        return hit
+
+    def correct(self, name: str) -> Optional[Dict]:
+        """
+        Resolve a misspelled name: correct each word against the vocabulary
+        and look the result up exactly; failing that, match the whole name
+        with spaces removed. None if nothing is close enough.
+        """
+        key = lexical_key(name)
+        if not key:
+            return None
+
+        tokens = []
+        changed = False
+        unknown = False
+        for token in key.split():
+            unknown = unknown or token not in self.spelling
+            # Codes like "e621" are exact or nothing: a near miss is another additive
+            hit = None if any(c.isdigit() for c in token) else \
+                self._guarded(self.spelling, self._knowledge_words, token)
+            if hit is not None and hit[1] > 0:
+                tokens.append(hit[0])
+                changed = True
+            else:
+                tokens.append(token)
+
+        doc = self.lookup(" ".join(tokens)) if changed else None
+        # Only names with an unknown word: "malt" is a word, not damaged "salt"
+        if doc is None and unknown and not any(c.isdigit() for c in key):
+            compact = key.replace(" ", "")
+            hit = self._guarded(self._compact, self._knowledge_compact, compact, max_distance_for(compact))
+            # A lexicon-only name resolves to no doc
+            if hit is not None and hit[0] in self._knowledge_compact:
+                doc = self._index.get(hit[0])
+
+        if doc is not None:
+            self.corrections += 1
+        return doc
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+from typing import List, Dict, Optional
+
+from services.ocr import extract_text_from_image
+from services.image_cache import image_fingerprint, IMAGE_HASH_TOLERANCE
+from services.pipeline import MAX_INGREDIENTS, relevant_ingredients, scored_item
+
+# Readings of the label an ingredient must appear in before it counts
+LIVE_CONFIRM_FRAMES = int(os.getenv("LIVE_CONFIRM_FRAMES", "2"))
+# A steady view counts as reading its label again after this many seconds
+LIVE_RECONFIRM_SECONDS = float(os.getenv("LIVE_RECONFIRM_SECONDS", "1.0"))
+# Consecutive frames without a change to the confirmed set before explaining it
+LIVE_STABLE_FRAMES = int(os.getenv("LIVE_STABLE_FRAMES", "2"))
+LIVE_MAX_INGREDIENTS = int(os.getenv("LIVE_MAX_INGREDIENTS", "12"))  # Explained per session
+
+
+class LiveSession:
+    """
+    State of one live-mode connection. Frames whose perceptual hash matches
+    the last OCR'd frame reuse its ingredients instead of running OCR again;
+    a view held steady for LIVE_RECONFIRM_SECONDS counts as a new reading.
+    Ingredients accumulate across frames (keyed by knowledge doc, so OCR
+    variants of one name merge) with a confidence from how consistently
+    they are read. Once the confirmed set has stopped changing, only the
+    ingredients not yet explained go to the LLM.
+    """
+
+    def __init__(self, pipeline, language: str = "en"):
+        self.pipeline = pipeline
+        self.language = language
+        self.frames = 0
+        self.ocr_frames = 0
+        self.skipped_frames = 0
+        self.readings = 0  # OCR'd frames plus re-confirmations of a steady view
+        self._read_at = 0.0
+        self.reset()
+
+    def reset(self):
+        """Forget accumulated ingredients (the user moved to another product)."""
+        self._last_phash = None
+        self._last_keys: List[str] = []
+        self._matches: Dict[str, Optional[Dict]] = {}  # label name -> scored match
+        self.ingredients: Dict[str, Dict] = {}         # doc key -> accumulated item
+        self.explained: Dict[str, Dict] = {}           # doc key -> explanation
+        self._unexplained = set()  # Asked for but left out of the LLM answer
+        self._confirmed = frozenset()
+        self._stable_for = 0
+
+    def _same_view(self, phash: Optional[int]) -> bool:
+        return (
+            phash is not None
+            and self._last_phash is not None
+            and (phash ^ self._last_phash).bit_count() <= IMAGE_HASH_TOLERANCE
+        )
+
+    def _read(self, image_bytes: bytes, fingerprint) -> List[str]:
+        """OCR one frame and return the doc keys of its ingredients."""
+        raw_text = extract_text_from_image(image_bytes, fingerprint=fingerprint)
+        names = list(dict.fromkeys(relevant_ingredients(raw_text or "")))
+
+        # Only names this session has not resolved yet need retrieval
+        new = [name for name in names if name not in self._matches]
+        if new:
+            try:
+                for match in self.pipeline.rag.retrieve_context_batch(new):
+                    self._matches[match["ingredient"]] = scored_item(match)
+            except Exception as e:
+                print(f"Live scoring failed: {e}")
+                return []
+
+        keys = []
+        for name in names:
+            item = self._matches.get(name)
+            if item is None:
+                continue
+            key = item["matched_ingredient"]
+            if key not in self.ingredients:
+                self.ingredients[key] = {**item, "hits": 0, "since": self.readings}
+            elif item["score"] > self.ingredients[key]["score"]:
+                # Keep the best reading of the label name
+                self.ingredients[key].update(item)
+            keys.append(key)
+        return list(dict.fromkeys(keys))
+
+    def confidence(self, key: str) -> float:
+        # Only readings count: a burst of duplicate frames is one look at the label
+        item = self.ingredients[key]
+        observed = self.readings - item["since"]
+        return round(item["score"] * item["hits"] / max(1, observed), 3)
+
+    def add_frame(self, image_bytes: bytes) -> Dict:
+        """
+        Fold one camera frame into the session. Returns the frame summary:
+        whether OCR was skipped, the accumulated ingredients and whether the
+        confirmed set is stable.
+        """
+        self.frames += 1
+        fingerprint = image_fingerprint(image_bytes)
+
+        now = time.monotonic()
+        if self._same_view(fingerprint[1]):
+            # Same label as last time: its text has not changed either
+            self.skipped_frames += 1
+            skipped = True
+            keys = self._last_keys
+            # A repeated frame only re-confirms the last reading once the
+            # camera has been held on it for a while
+            reading = now - self._read_at >= LIVE_RECONFIRM_SECONDS
+        else:
+            skipped = False
+            keys = self._read(image_bytes, fingerprint)
+            self.ocr_frames += 1
+            self._last_phash = fingerprint[1]
+            self._last_keys = keys
+            reading = True
+
+        if reading:
+            self.readings += 1
+            self._read_at = now
+            for key in keys:
+                self.ingredients[key]["hits"] += 1
+
+        confirmed = frozenset(
+            key for key, item in self.ingredients.items()
+            if item["hits"] >= LIVE_CONFIRM_FRAMES
+        )
+        if confirmed == self._confirmed:
+            self._stable_for += 1
+        else:
+            self._confirmed = confirmed
+            self._stable_for = 0
+
+        return {
+            "frame": self.frames,
+            "skipped": skipped,
+            "stable": self.stable,
+            "ingredients": [
+                {
+                    "ingredient": item["ingredient"],
+                    "confidence": self.confidence(key),
+                    "confirmed": key in confirmed,
+                    "explained": key in self.explained,
+                }
+                for key, item in sorted(
+                    self.ingredients.items(),
+                    key=lambda kv: self.confidence(kv[0]), reverse=True
+                )
+            ],
+        }
+
+    @property
+    def stable(self) -> bool:
+        return bool(self._confirmed) and self._stable_for >= LIVE_STABLE_FRAMES
+
+    def pending(self) -> List[Dict]:
+        """Confirmed ingredients still to explain, most confident first."""
+        if not self.stable:
+            return []
+        room = LIVE_MAX_INGREDIENTS - len(self.explained)
+        keys = sorted(
+            (key for key in self._confirmed
+             if key not in self.explained and key not in self._unexplained),
+            key=self.confidence, reverse=True
+        )
+        return [self.ingredients[key] for key in keys[:max(0, min(room, MAX_INGREDIENTS))]]
+
+    def explain_pending(self) -> List[Dict]:
+        """
+        Explain the delta: confirmed ingredients not explained yet, in one
+        explanation call. Returns the new explanations ([] if none are due).
+        """
+        selected = self.pending()
+        if not selected:
+            return []
+
+        results = []
+        try:
+            for event in self.pipeline.iter_explanations(selected, language=self.language):
+                item = selected[event.pop("index")]
+                self.explained[item["matched_ingredient"]] = event
+                results.append(event)
+        except Exception:
+            # Wait for a few more steady frames before asking again
+            self._stable_for = 0
+            raise
+
+        # Don't ask again every frame for what the LLM skipped
+        self._unexplained.update(
+            item["matched_ingredient"] for item in selected
+            if item["matched_ingredient"] not in self.explained
+        )
+        return results
+
+    def analysis(self) -> Dict:
+        """Everything explained so far, shaped like an /analyze result."""
+        if not self.explained:
+            return {
+                "success": True,
+                "ingredients": [],
+                "message": "No recognizable ingredients found"
+            }
+        return {
+            "success": True,
+            "ingredients_detected": [self.ingredients[key]["ingredient"] for key in self.explained],
+            "analysis": json.dumps({"results": list(self.explained.values())}, ensure_ascii=False),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "ocr_frames": self.ocr_frames,
+            "skipped_frames": self.skipped_frames,
+            "readings": self.readings,
+            "ingredients": len(self.ingredients),
+            "explained": len(self.explained),
+        }
@@ -0,0 +1,220 @@
+import os
+import time
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Dict, Optional
+
+from services.history_cache import session_history
+
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "50"))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.5"))
+MESSAGE_MAX_RETRIES = int(os.getenv("MESSAGE_MAX_RETRIES", "5"))
+# "async" (write-behind) or "sync" (insert on the calling thread, for tests)
+MESSAGE_WRITE_MODE = os.getenv("MESSAGE_WRITE_MODE", "async")
+# "supabase" or "memory" (local stand-in, no network)
+MESSAGE_BACKEND = os.getenv("MESSAGE_BACKEND", "supabase")
+
+# Postgres SQLSTATE classes meaning the row itself was refused (22: data
+# exception, e.g. value too long; 23: constraint violation, e.g. unknown
+# session_id). Retrying cannot help.
+REJECTED_SQLSTATE_CLASSES = {"22", "23"}
+
+
+class SupabaseMessageBackend:
+    def insert_many(self, rows: List[Dict]):
+        from database import supabase
+        supabase.table("messages").insert(rows).execute()
+
+    @staticmethod
+    def is_permanent(error: Exception) -> bool:
+        code = str(getattr(error, "code", "") or "")
+        return code[:2] in REJECTED_SQLSTATE_CLASSES
+
+
+class InMemoryMessageBackend:
+    """Offline stand-in for the messages table."""
+
+    REQUIRED = ("session_id", "role", "content")
+
+    def __init__(self):
+        self.rows = []
+        self._lock = threading.Lock()
+
+    def insert_many(self, rows: List[Dict]):
+        # All or nothing, like a bulk insert into the real table
+        for row in rows:
+            missing = [field for field in self.REQUIRED if row.get(field) is None]
+            if missing:
+                raise ValueError(f"null value in column {missing[0]}")
+        with self._lock:
+            self.rows.extend(dict(r) for r in rows)
+
+    @staticmethod
+    def is_permanent(error: Exception) -> bool:
+        return isinstance(error, ValueError)
+
+    def select_session(self, session_id: str) -> List[Dict]:
+        with self._lock:
+            rows = [r for r in self.rows if r["session_id"] == session_id]
+        return sorted(rows, key=lambda r: r["created_at"])
+
+
+class MessageWriter:
+    """
+    Write-behind queue for message inserts. Requests enqueue and return;
+    a background thread flushes bulk inserts when MESSAGE_BATCH_SIZE rows
+    are waiting or MESSAGE_FLUSH_INTERVAL has passed, retrying with backoff.
+    A batch the database refuses outright is retried row by row, so one bad
+    row costs only itself.
+    """
+
+    def __init__(self, backend=None, batch_size: int = MESSAGE_BATCH_SIZE,
+                 flush_interval: float = MESSAGE_FLUSH_INTERVAL,
+                 max_retries: int = MESSAGE_MAX_RETRIES, sync: bool = MESSAGE_WRITE_MODE == "sync"):
+        self.backend = backend or self._default_backend()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.sync = sync
+
+        self._queue = deque()
+        self._in_flight = []  # Batch the writer thread is inserting right now
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+        self.split_batches = 0
+
+    @staticmethod
+    def _default_backend():
+        if MESSAGE_BACKEND == "memory":
+            return InMemoryMessageBackend()
+        return SupabaseMessageBackend()
+
+    def start(self):
+        if self.sync or self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, message: Dict):
+        row = dict(message)
+        # Stamped here so rows batched together keep their chat order
+        row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+
+        if self.sync or self._thread is None:
+            self._write([row])
+            return
+
+        with self._cond:
+            self._queue.append(row)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._queue and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                elif len(self._queue) < self.batch_size and not self._stopping:
+                    # Give a partial batch the rest of the interval to fill up
+                    self._cond.wait(self.flush_interval)
+
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._in_flight = batch
+                done = self._stopping and not self._queue
+
+            if batch:
+                self._write(batch)
+                with self._cond:
+                    self._in_flight = []
+                    self._cond.notify_all()
+            if done:
+                return
+
+    def _permanent(self, error: Exception) -> bool:
+        is_permanent = getattr(self.backend, "is_permanent", None)
+        return bool(is_permanent and is_permanent(error))
+
+    def _write(self, rows: List[Dict]):
+        delay = 0.2
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.backend.insert_many(rows)
+                self.written += len(rows)
+                self.batches += 1
+                return
+            except Exception as e:
+                if self._permanent(e):
+                    if len(rows) > 1:
+                        # One bad row fails the whole bulk insert: find it
+                        self.split_batches += 1
+                        print(f"[WARNING] Batch of {len(rows)} messages refused, inserting one by one: {e}")
+                        for row in rows:
+                            self._write([row])
+                    else:
+                        self.dropped += 1
+                        print(f"[ERROR] Dropping message refused by the database: {e}")
+                    return
+                if attempt == self.max_retries:
+                    self.dropped += len(rows)
+                    print(f"[ERROR] Dropping {len(rows)} messages after {attempt + 1} attempts: {e}")
+                    return
+                self.retries += 1
+                print(f"[WARNING] Message insert failed, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    def flush(self, session_id: str, timeout: Optional[float] = 10.0):
+        """
+        Write a session's queued messages now, on the calling thread, and
+        wait out a batch in flight that holds any of them. After this the
+        database has everything saved for the session so far.
+        """
+        def in_flight():
+            return any(row["session_id"] == session_id for row in self._in_flight)
+
+        with self._cond:
+            self._cond.wait_for(lambda: not in_flight(), timeout)
+            rows = [row for row in self._queue if row["session_id"] == session_id]
+            if not rows:
+                return
+            self._queue = deque(row for row in self._queue if row["session_id"] != session_id)
+
+        self._write(rows)
+
+    def drain(self, timeout: Optional[float] = 10.0):
+        """Flush everything still queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "mode": "sync" if self.sync else "async",
+            "queued": len(self._queue),
+            "written": self.written,
+            "batches": self.batches,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "split_batches": self.split_batches,
+        }
+
+
+message_writer = MessageWriter()
+
+
+def save_message(message: Dict):
+    """Record a message in the session ring buffer and queue it for the database."""
+    session_history.append(message["session_id"], message)
+    message_writer.enqueue(message)
@@ -1,25 +1,42 @@
+from services.aho_corasick import Automaton
+from services.knowledge_loader import load_lexicon
+
+# lexicon/normalization.json: {"corrections": {ocr text: name}, "stopwords": [...]}
+_lexicon = load_lexicon("normalization.json", {})
+
 NORMALIZATION_MAP = {
-    "sait": "Salt",
-    "fron": "Iron",
-    "lee niacin": "Niacin",
-    "butter oil a": "Butter Oil",
-    "fatrecuced": "Fat Reduced",
-    "nergy": "Energy",
+    k.lower(): v for k, v in _lexicon.get("corrections", {}).items()
 }
 
-STOPWORDS = [
-    "typical", "value", "nutrition", "energy", "protein"
-]
+STOPWORDS = [w.lower() for w in _lexicon.get("stopwords", [])]
+
+# One automaton over corrections and stopwords, so each name is scanned
+# once no matter how many entries the lexicon has. Corrections keep their
+# file order as priority: the earliest listed one that occurs wins.
+_MATCHER = Automaton(
+    [(k, (rank, v)) for rank, (k, v) in enumerate(NORMALIZATION_MAP.items())]
+    + [(sw, None) for sw in STOPWORDS]
+)
 
 
 def normalize_ingredient(name: str) -> str:
     n = name.lower()
 
-    for k, v in NORMALIZATION_MAP.items():
-        if k in n:
-            return v
+    correction = None
+    stopword_spans = []
+    for start, end, value in _MATCHER.finditer(n):
+        if value is None:
+            stopword_spans.append((start, end))
+        elif correction is None or value[0] < correction[0]:
+            correction = value
+
+    if correction is not None:
+        return correction[1]
 
-    for sw in STOPWORDS:
-        n = n.replace(sw, "")
+    if stopword_spans:
+        keep = [True] * len(n)
+        for start, end in stopword_spans:
+            keep[start:end] = [False] * (end - start)
+        n = "".join(ch for ch, k in zip(n, keep) if k)
 
     return n.strip().title()
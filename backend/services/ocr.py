@@ -1,41 +1,29 @@
-import pytesseract
-from PIL import Image
-import io
+from services.image_cache import ocr_cache, image_fingerprint
+from services.ocr_engine import ocr_engine, configure_tesseract, OCRBusyError, OCRTimeoutError
 
+configure_tesseract()
 
-import os
 
-# Set Tesseract Valid Path
-TESSERACT_PATH = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-if os.path.exists(TESSERACT_PATH):
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH 
-
-def extract_text_from_image(image_bytes: bytes) -> str:    
+def extract_text_from_image(image_bytes: bytes, fingerprint=None) -> str:
     """
-    Extract text from an image using Tesseract OCR.        
+    Extract text from an image using Tesseract OCR.
     Returns cleaned text (safe for NLP).
+    Repeat uploads of the same image bytes come from ocr_cache;
+    everything else runs on the shared OCR worker pool.
     """
-    try:
-        image = Image.open(io.BytesIO(image_bytes))        
-
-        # Optimization: Resize if image is too large (reduces OCR time significantly)
-        # 1500px is sufficient for ingredient text and faster
-        if image.width > 1500 or image.height > 1500:      
-            image.thumbnail((1500, 1500), Image.Resampling.LANCZOS)
-
-        image = image.convert("L")  # grayscale
-
-        text = pytesseract.image_to_string(
-            image,
-            lang="eng",
-            config="--psm 6 --oem 3"
-        )
-
-        text = text.replace("\n", " ")
-        text = " ".join(text.split())
-
-        return text
+    fingerprint = fingerprint or image_fingerprint(image_bytes)
+    cached = ocr_cache.get(fingerprint)
+    if cached is not None:
+        return cached
 
+    try:
+        text = ocr_engine.run(image_bytes)
 
+    except (OCRBusyError, OCRTimeoutError):
+        # Let routers map these to 503 / 504
+        raise
     except Exception as e:
-        raise RuntimeError(f"OCR failed: {str(e)}")   
\ No newline at end of file
+        raise RuntimeError(f"OCR failed: {str(e)}")
+
+    ocr_cache.set(fingerprint, text)
+    return text
@@ -0,0 +1,480 @@
+import io
+import os
+import re
+import glob
+import math
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Optional, Tuple
+
+import pytesseract
+from PIL import Image
+
+# Set Tesseract Valid Path
+TESSERACT_PATH = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", str(OCR_WORKERS * 4)))
+OCR_JOB_TIMEOUT = float(os.getenv("OCR_JOB_TIMEOUT", "20"))
+# After a timeout, how long the job gets to stop before its pool is killed
+OCR_KILL_GRACE = float(os.getenv("OCR_KILL_GRACE", "5"))
+
+TESSERACT_LANG = "eng"
+TESSERACT_CONFIG = "--psm 6 --oem 3"
+LAYOUT_CONFIG = "--psm 3 --oem 3"
+
+# Ingredient-block detection before full OCR
+OCR_CROP_DETECTION = os.getenv("OCR_CROP_DETECTION", "true").lower() == "true"
+FULL_MAX_SIDE = 1500  # Sufficient for ingredient text and faster
+LAYOUT_MAX_SIDE = 800  # Layout analysis only needs the paragraph shapes
+HEAD_WIDTH = 6  # Line heights of each paragraph's first line read for the keyword
+HEAD_HEIGHT = 24  # Pixel height heads are scaled to before they are read together
+HEAD_PADDING = 12
+CROP_MIN_WIDTH = 1200
+CROP_MAX_SIDE = 2500
+CROP_MIN_CHARS = 20  # Less than this from the crop means detection misfired
+
+# Tolerates common OCR confusions: "lngredients", "ingred1ents", "INGREDIENT:",
+# and a first letter lost at the edge of a line ("NGREDIENTS")
+INGREDIENTS_WORD_RE = re.compile(r"[il1|]?ngred[il1|]ents?")
+
+
+class OCRBusyError(RuntimeError):
+    """Raised when the OCR queue is full; callers should answer 503."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("OCR engine is busy, retry later")
+        self.retry_after = retry_after
+
+
+class OCRTimeoutError(RuntimeError):
+    pass
+
+
+def configure_tesseract():
+    if os.path.exists(TESSERACT_PATH):
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
+
+
+# ---------- Worker process side ----------
+
+# Per-process Tesseract handle: tesserocr keeps the traineddata loaded for
+# the life of the worker. pytesseract (a tesseract process per job) is only
+# the fallback when tesserocr cannot load.
+_api = None
+
+
+def _tessdata_path() -> Optional[str]:
+    # The tesserocr wheel does not know where the system traineddata lives
+    if os.getenv("TESSDATA_PREFIX"):
+        return os.getenv("TESSDATA_PREFIX")
+    found = sorted(glob.glob("/usr/share/tesseract-ocr/*/tessdata"))
+    return found[-1] if found else None
+
+
+def _init_worker():
+    global _api
+    configure_tesseract()
+    try:
+        import tesserocr
+        options = {"path": _tessdata_path()} if _tessdata_path() else {}
+        _api = tesserocr.PyTessBaseAPI(
+            lang=TESSERACT_LANG,
+            psm=tesserocr.PSM.SINGLE_BLOCK,
+            oem=tesserocr.OEM.DEFAULT,
+            **options,
+        )
+    except ImportError:
+        print("[WARNING] tesserocr not installed, using pytesseract")
+        _api = None
+    except Exception as e:
+        print(f"[WARNING] tesserocr init failed, using pytesseract: {e}")
+        _api = None
+
+
+def _remaining(deadline: float) -> float:
+    # The deadline is wall-clock time so parent and worker share it
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise TimeoutError("OCR deadline passed")
+    return remaining
+
+
+def recognize(image: Image.Image, timeout: float = OCR_JOB_TIMEOUT) -> str:
+    """Run Tesseract on a prepared image with the worker's engine."""
+    if _api is not None:
+        _api.SetImage(image)
+        # Tesseract cancels itself once the timeout (ms) passes
+        if not _api.Recognize(max(1, int(timeout * 1000))):
+            raise TimeoutError(f"Tesseract gave up after {timeout:.1f}s")
+        return _api.GetUTF8Text()
+
+    return pytesseract.image_to_string(
+        image,
+        lang=TESSERACT_LANG,
+        config=TESSERACT_CONFIG,
+        timeout=timeout,
+    )
+
+
+def layout_paragraphs(image: Image.Image, timeout: float = OCR_JOB_TIMEOUT) -> List[Dict]:
+    """
+    Paragraphs of the page in reading order: box, first-line box and
+    height. With tesserocr this is layout analysis only (no recognition);
+    "head" is then None until read_heads() reads it. pytesseract cannot
+    analyse without recognizing, so it reads the (downscaled) page once.
+    """
+    if _api is not None:
+        import tesserocr
+        paragraphs = []
+        _api.SetPageSegMode(tesserocr.PSM.AUTO)
+        _api.SetImage(image)
+        iterator = _api.AnalyseLayout()
+        while iterator is not None:
+            box = iterator.BoundingBox(tesserocr.RIL.PARA)
+            line = iterator.BoundingBox(tesserocr.RIL.TEXTLINE)
+            if box and line:
+                paragraphs.append({"box": box, "line": line, "line_height": line[3] - line[1], "head": None})
+            if not iterator.Next(tesserocr.RIL.PARA):
+                break
+        return paragraphs
+
+    data = pytesseract.image_to_data(
+        image,
+        lang=TESSERACT_LANG,
+        config=LAYOUT_CONFIG,
+        output_type=pytesseract.Output.DICT,
+        timeout=timeout,
+    )
+    paragraphs = {}
+    for i, text in enumerate(data["text"]):
+        if not text.strip():
+            continue
+        left, top = data["left"][i], data["top"][i]
+        right, bottom = left + data["width"][i], top + data["height"][i]
+        key = (data["block_num"][i], data["par_num"][i])
+        if key not in paragraphs:
+            paragraphs[key] = {"box": [left, top, right, bottom], "line_num": data["line_num"][i],
+                               "line_height": 0, "head": ""}
+        paragraph = paragraphs[key]
+        box = paragraph["box"]
+        paragraph["box"] = [min(box[0], left), min(box[1], top), max(box[2], right), max(box[3], bottom)]
+        if data["line_num"][i] == paragraph["line_num"]:
+            paragraph["head"] += " " + text
+            paragraph["line_height"] = max(paragraph["line_height"], bottom - top)
+    return [
+        {"box": tuple(p["box"]), "line": None, "line_height": p["line_height"], "head": p["head"]}
+        for p in paragraphs.values()
+    ]
+
+
+def read_heads(image: Image.Image, paragraphs: List[Dict], timeout: float = OCR_JOB_TIMEOUT):
+    """
+    Fill in the first few words of each paragraph, where an "Ingredients"
+    heading sits. The heads are scaled to one height and stacked into a
+    single small image, so they cost one recognition instead of one each.
+    """
+    pending = [p for p in paragraphs if p["head"] is None]
+    if not pending:
+        return
+    import tesserocr
+
+    row = HEAD_HEIGHT + HEAD_PADDING
+    heads = []
+    for paragraph in pending:
+        left, top, right, bottom = paragraph["line"]
+        height = max(1, bottom - top)
+        head = image.crop((left, top, min(right, left + HEAD_WIDTH * height), bottom))
+        heads.append(head.resize(
+            (max(1, round(head.width * HEAD_HEIGHT / height)), HEAD_HEIGHT), Image.Resampling.BILINEAR
+        ))
+    sheet = Image.new("L", (max(h.width for h in heads) + 2 * HEAD_PADDING, len(heads) * row + HEAD_PADDING), 255)
+    for k, head in enumerate(heads):
+        sheet.paste(head, (HEAD_PADDING, HEAD_PADDING + k * row))
+        pending[k]["head"] = ""
+
+    _api.SetPageSegMode(tesserocr.PSM.SINGLE_BLOCK)
+    _api.SetImage(sheet)
+    if not _api.Recognize(max(1, int(timeout * 1000))):
+        raise TimeoutError(f"Tesseract gave up after {timeout:.1f}s")
+    iterator = _api.GetIterator()
+    while iterator is not None:
+        box = iterator.BoundingBox(tesserocr.RIL.TEXTLINE)
+        try:
+            text = iterator.GetUTF8Text(tesserocr.RIL.TEXTLINE)
+        except RuntimeError:
+            text = None  # tesserocr raises instead of returning no text
+        if box and text:
+            # A text line belongs to the head whose row holds its centre
+            k = min(len(pending) - 1, max(0, ((box[1] + box[3]) // 2 - HEAD_PADDING // 2) // row))
+            pending[k]["head"] += text
+        if not iterator.Next(tesserocr.RIL.TEXTLINE):
+            break
+
+
+def find_ingredients_box(image: Image.Image, deadline: float) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Bounding box of the paragraph starting with the "Ingredients" keyword,
+    extended with the paragraphs that continue directly below it.
+    """
+    try:
+        paragraphs = layout_paragraphs(image, timeout=_remaining(deadline))
+        read_heads(image, paragraphs, timeout=_remaining(deadline))
+    finally:
+        if _api is not None:
+            import tesserocr
+            _api.SetPageSegMode(tesserocr.PSM.SINGLE_BLOCK)
+
+    anchor = next(
+        (i for i, p in enumerate(paragraphs) if INGREDIENTS_WORD_RE.search(p["head"].lower())),
+        None
+    )
+    if anchor is None:
+        return None
+
+    left, top, right, bottom = paragraphs[anchor]["box"]
+    line_height = max(1, paragraphs[anchor]["line_height"])
+
+    # Labels often split one list into several paragraphs
+    for paragraph in paragraphs[anchor + 1:]:
+        p_left, p_top, p_right, p_bottom = paragraph["box"]
+        overlaps = p_left < right and p_right > left
+        if overlaps and 0 <= p_top - bottom <= 1.5 * line_height:
+            left, right = min(left, p_left), max(right, p_right)
+            bottom = max(bottom, p_bottom)
+
+    # Keep a margin so characters at the edge are not clipped
+    return (left - line_height, top - line_height, right + line_height, bottom + line_height)
+
+
+def _crop_ingredients(image: Image.Image, deadline: float) -> Optional[Image.Image]:
+    layout = image.copy()
+    layout.thumbnail((LAYOUT_MAX_SIDE, LAYOUT_MAX_SIDE), Image.Resampling.BILINEAR)
+
+    box = find_ingredients_box(layout, deadline)
+    if box is None:
+        return None
+
+    # Map the low-res box back onto the full-resolution image
+    scale = image.width / layout.width
+    left, top, right, bottom = (int(v * scale) for v in box)
+    crop = image.crop((
+        max(0, left), max(0, top),
+        min(image.width, right), min(image.height, bottom)
+    ))
+
+    if crop.width < 10 or crop.height < 10:
+        return None
+
+    # Small crops are upscaled; Tesseract reads best at ~30px text height
+    if crop.width < CROP_MIN_WIDTH:
+        factor = CROP_MIN_WIDTH / crop.width
+        crop = crop.resize((CROP_MIN_WIDTH, int(crop.height * factor)), Image.Resampling.LANCZOS)
+    if crop.width > CROP_MAX_SIDE or crop.height > CROP_MAX_SIDE:
+        crop.thumbnail((CROP_MAX_SIDE, CROP_MAX_SIDE), Image.Resampling.LANCZOS)
+    return crop
+
+
+def _ocr_job(image_bytes: bytes, deadline: float) -> Dict:
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image = image.convert("L")  # grayscale
+
+        text, mode = "", "full"
+
+        # Cheap pre-pass: find the ingredients block by layout, then OCR
+        # only that block, at full resolution
+        if OCR_CROP_DETECTION:
+            try:
+                crop = _crop_ingredients(image, deadline)
+                if crop is not None:
+                    text = recognize(crop, timeout=_remaining(deadline))
+                    mode = "crop"
+            except Exception as e:
+                print(f"[WARNING] Ingredient block detection failed, reading the full label: {e}")
+
+        # Fall back to the full label when no usable block was found
+        if len(text.strip()) < CROP_MIN_CHARS:
+            # Optimization: Resize if image is too large (reduces OCR time significantly)
+            if image.width > FULL_MAX_SIDE or image.height > FULL_MAX_SIDE:
+                image.thumbnail((FULL_MAX_SIDE, FULL_MAX_SIDE), Image.Resampling.LANCZOS)
+
+            text = recognize(image, timeout=_remaining(deadline))
+            mode = "full" if mode == "full" else "crop_fallback"
+
+    except Exception as e:
+        # Some pytesseract errors cannot be unpickled in the parent and
+        # would mark the whole pool as broken; send a plain error instead
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+    text = text.replace("\n", " ")
+    return {"text": " ".join(text.split()), "mode": mode}
+
+
+# ---------- Parent process side ----------
+
+class OCREngine:
+    """
+    Fixed pool of long-lived OCR worker processes with a bounded queue.
+    Jobs beyond `queue_size` in flight are rejected with OCRBusyError
+    instead of piling up behind the CPU.
+    """
+
+    def __init__(self, workers: int = OCR_WORKERS, queue_size: int = OCR_QUEUE_SIZE,
+                 job_timeout: float = OCR_JOB_TIMEOUT):
+        self.workers = max(1, workers)
+        self.queue_size = max(self.workers, queue_size)
+        self.job_timeout = job_timeout
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._in_flight = 0
+        self._avg_seconds = 1.0
+
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.modes = {"crop": 0, "crop_fallback": 0, "full": 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn: never fork a parent that already holds torch threads
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                    )
+        return self._executor
+
+    def _reset_executor(self, executor: Optional[ProcessPoolExecutor] = None, kill: bool = False):
+        """
+        Drop the pool (only if it is still `executor`, when given) so the
+        next job starts a fresh one. kill=True also terminates its workers.
+        """
+        with self._lock:
+            if executor is None:
+                executor = self._executor
+            if executor is None or executor is not self._executor:
+                return
+            self._executor = None
+        if kill:
+            # No public API stops a running job; terminating its process does
+            for process in list((getattr(executor, "_processes", None) or {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _reap(self, future: Future, executor: ProcessPoolExecutor):
+        """
+        A timed-out job keeps its worker busy (a running future cannot be
+        cancelled). Give it OCR_KILL_GRACE to stop on its own timeout, then
+        replace the pool so the stuck worker does not shrink it for good.
+        """
+        if future.cancel():
+            return
+
+        def _check():
+            if future.done():
+                return
+            print("[WARNING] OCR worker still busy after a timeout, recycling the pool")
+            self.recycled += 1
+            self._reset_executor(executor, kill=True)
+
+        timer = threading.Timer(OCR_KILL_GRACE, _check)
+        timer.daemon = True
+        timer.start()
+
+    def start(self):
+        """Spin up the worker processes ahead of the first request."""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(int)
+
+    def retry_after(self) -> int:
+        waiting = max(1, self._in_flight - self.workers + 1)
+        return max(1, math.ceil(self._avg_seconds * waiting / self.workers))
+
+    def submit(self, image_bytes: bytes) -> Tuple[Future, ProcessPoolExecutor]:
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise OCRBusyError(self.retry_after())
+
+        with self._lock:
+            self._in_flight += 1
+        started = time.perf_counter()
+
+        def _release(future):
+            elapsed = time.perf_counter() - started
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                # A worker died (e.g. OOM); the next job gets a fresh pool
+                self._reset_executor(executor)
+            with self._lock:
+                self._in_flight -= 1
+                self.completed += 1
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+            self._slots.release()
+
+        try:
+            executor = self._get_executor()
+            # One deadline for every pass of the job, queueing included
+            future = executor.submit(_ocr_job, image_bytes, time.time() + self.job_timeout)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+            raise
+
+        future.add_done_callback(_release)
+        return future, executor
+
+    def _unwrap(self, result: Dict) -> str:
+        self.modes[result["mode"]] += 1
+        return result["text"]
+
+    def run(self, image_bytes: bytes) -> str:
+        """Blocking OCR for executor threads (e.g. the analysis pipeline)."""
+        future, executor = self.submit(image_bytes)
+        try:
+            return self._unwrap(future.result(timeout=self.job_timeout))
+        except FutureTimeoutError:
+            self.timeouts += 1
+            self._reap(future, executor)
+            raise OCRTimeoutError(f"OCR timed out after {self.job_timeout}s")
+
+    async def run_async(self, image_bytes: bytes) -> str:
+        future, executor = self.submit(image_bytes)
+        try:
+            # shield: a timeout must not cancel the future before _reap sees it
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.job_timeout)
+            return self._unwrap(result)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._reap(future, executor)
+            raise OCRTimeoutError(f"OCR timed out after {self.job_timeout}s")
+
+    def shutdown(self):
+        self._reset_executor()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self._in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "recycled": self.recycled,
+            "avg_job_seconds": round(self._avg_seconds, 3),
+            "modes": dict(self.modes),
+        }
+
+
+ocr_engine = OCREngine()
@@ -1,9 +1,28 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+
 from services.ocr import extract_text_from_image
 from services.extractor import extract_ingredients
-from services.rag_engine import RAGEngine
+from services.engine_registry import get_rag_engine, get_explanation_store
+from services.rag_engine import parse_results, ResultStreamParser
+from services.image_cache import analysis_cache, image_fingerprint
+from services.ocr_engine import OCR_WORKERS
+from services.explanation_store import normalize_language
 
 MAX_INGREDIENTS = 6  # HARD LIMIT for speed + UX
 
+# Vector matches at or above this score are treated as "this knowledge doc"
+# and can be served from / saved to the explanation store
+EXPLANATION_MIN_SCORE = 0.6
+
+# Error of a result whose LLM step failed (timeout etc.); worth retrying
+EXPLANATION_FAILED = "Analysis failed or timed out"
+
+# Products of one batch explained at the same time (one LLM call each)
+BATCH_EXPLAIN_WORKERS = int(os.getenv("BATCH_EXPLAIN_WORKERS", "4"))
+
 SKIP_WORDS = {
     "flavouring",
     "added flavour",
@@ -13,18 +32,192 @@ SKIP_WORDS = {
 }
 
 
+def drain(gen):
+    """Run a generator to completion and return its return value."""
+    while True:
+        try:
+            next(gen)
+        except StopIteration as stop:
+            return stop.value
+
+
+def scored_item(match: Dict) -> Dict:
+    """A retrieve_context_batch match as a scored ingredient."""
+    return {
+        "ingredient": match["ingredient"],
+        "matched_ingredient": match["matched_ingredient"],
+        "match_type": match["match_type"],
+        "score": match["similarity_score"],
+        "context": match["context"],
+    }
+
+
+def relevant_ingredients(raw_text: str) -> List[str]:
+    """Extracted ingredients minus generic label words."""
+    return [
+        ing for ing in extract_ingredients(raw_text)
+        if ing.lower() not in SKIP_WORDS
+    ]
+
+
+def tagged(event: str, gen):
+    """Re-yield a generator's items as (event, item), keeping its return value."""
+    while True:
+        try:
+            item = next(gen)
+        except StopIteration as stop:
+            return stop.value
+        yield event, item
+
+
+def recorded(gen, indices: List[int]):
+    """Re-yield explanation events, noting each one's index; keeps the return value."""
+    while True:
+        try:
+            item = next(gen)
+        except StopIteration as stop:
+            return stop.value
+        indices.append(item["index"])
+        yield item
+
+
 class FoodAnalysisPipeline:
     def __init__(self):
-        self.rag = RAGEngine()
+        self.rag = get_rag_engine()
+        self.explanations = get_explanation_store()
+
+    def _matched_document(self, item: Dict):
+        if item["match_type"] == "lexical" or item["score"] >= EXPLANATION_MIN_SCORE:
+            return self.rag.get_document(item["matched_ingredient"])
+        return None
+
+    def iter_explanations(self, selected: List[Dict], language: str = "en", stream: bool = False):
+        """
+        Generator over explanation results for the selected ingredients;
+        returns the final {"results": [...]} JSON (in scan order).
+        Confidently matched docs are served from the explanation store;
+        only the remaining ingredients go to the LLM, in one call. With
+        stream=True each LLM result is yielded as soon as it is parsed.
+        """
+        results = [None] * len(selected)
+        pending = []   # (position, prompt name)
+        pinned = {}    # prompt name -> knowledge doc
+        retrieved = {} # prompt name -> context blocks from the scoring pass
+        seen_docs = set()
+
+        for i, item in enumerate(selected):
+            doc = self._matched_document(item)
+            if doc is None:
+                pending.append((i, item["ingredient"]))
+                if item.get("context"):
+                    retrieved[item["ingredient"]] = item["context"]
+                continue
+
+            # Two label names resolving to one doc get a single explanation
+            if doc["ingredient"] in seen_docs:
+                continue
+            seen_docs.add(doc["ingredient"])
+
+            cached = self.explanations.get(doc, language)
+            if cached is not None:
+                results[i] = cached
+                yield {"index": i, **cached}
+            else:
+                pinned[doc["ingredient"]] = doc
+                pending.append((i, doc["ingredient"]))
+
+        if pending:
+            names = [name for _, name in pending]
+            contexts = dict(retrieved)
+            contexts.update(
+                (name, [self.rag.document_context(doc)])
+                for name, doc in pinned.items()
+            )
+            by_name = {name.lower(): (pos, i, name) for pos, (i, name) in enumerate(pending)}
+            unassigned = list(range(len(pending)))
+
+            def _accept(result: Dict, order: int):
+                # Match by name; fall back to prompt order for renamed items
+                match = by_name.get(str(result.get("ingredient", "")).lower())
+                if match is None and order < len(pending):
+                    match = (order,) + pending[order]
+                if match is None or match[0] not in unassigned:
+                    return None
+                pos, i, name = match
+                unassigned.remove(pos)
+                results[i] = result
+                if name in pinned:
+                    self.explanations.put(pinned[name], language, result)
+                return {"index": i, **result}
+
+            generated = 0
+            if stream:
+                parser = ResultStreamParser()
+                for delta in self.rag.stream_ingredients_batch(names, language=language, contexts=contexts):
+                    for result in parser.feed(delta):
+                        accepted = _accept(result, generated)
+                        generated += 1
+                        if accepted is not None:
+                            yield accepted
+                content = parser.buffer.strip()
+            else:
+                content = self.rag.explain_ingredients_batch(names, language=language, contexts=contexts)
+                try:
+                    for result in parse_results(content):
+                        if isinstance(result, dict):
+                            accepted = _accept(result, generated)
+                            generated += 1
+                            if accepted is not None:
+                                yield accepted
+                except ValueError as e:
+                    print(f"Could not parse explanation batch: {e}")
+
+            if not any(results):
+                # Nothing usable to merge; keep the old raw behaviour
+                return content
+
+        return json.dumps(
+            {"results": [r for r in results if r is not None]},
+            ensure_ascii=False
+        )
+
+    def explain_selected(self, selected: List[Dict], language: str = "en") -> str:
+        return drain(self.iter_explanations(selected, language=language))
 
     def analyze_image(self, image_bytes: bytes, language: str = "en"):
         """
         Optimized & confidence-driven pipeline:
         Image → OCR → Ingredient extraction → Confidence ranking → Batched RAG
         """
+        return drain(self.analyze_image_events(image_bytes, language=language))
+
+    def analyze_image_events(self, image_bytes: bytes, language: str = "en", stream: bool = False):
+        """
+        Same pipeline as analyze_image, as a generator of (event, data) pairs
+        emitted as each stage completes: "raw_text", "ingredients_detected",
+        then one "explanation" per ingredient. Returns the final result dict.
+        """
+
+        # Step 0: Repeat uploads of the same image skip OCR + LLM entirely
+        fingerprint = image_fingerprint(image_bytes)
+        variant = normalize_language(language)
+        cached = analysis_cache.get(fingerprint, variant=variant)
+        if cached is not None:
+            cached, indices = cached
+            result = dict(cached)  # callers add keys to the result
+            if "raw_text" in result:
+                yield "raw_text", result["raw_text"]
+                yield "ingredients_detected", result["ingredients_detected"]
+                try:
+                    # Stored results are in index order, with gaps for skipped names
+                    for i, item in zip(indices, parse_results(result["analysis"])):
+                        yield "explanation", {"index": i, **item}
+                except ValueError:
+                    pass
+            return result
 
         # Step 1: OCR
-        raw_text = extract_text_from_image(image_bytes)
+        raw_text = extract_text_from_image(image_bytes, fingerprint=fingerprint)
 
         if not raw_text or not raw_text.strip():
             return {
@@ -32,6 +225,8 @@ class FoodAnalysisPipeline:
                 "error": "No text detected in image"
             }
 
+        yield "raw_text", raw_text
+
         # Step 2: Ingredient extraction
         ingredients = extract_ingredients(raw_text)
 
@@ -55,19 +250,15 @@ class FoodAnalysisPipeline:
                 "message": "No relevant ingredients after filtering"
             }
 
-        # Step 4: Confidence scoring using vector store
         # Step 4: Confidence scoring using vector store (BATCHED)
         try:
             scored_ingredients = []
             
-            # Use top_k=1 for speed in initial filtering
-            results = self.rag.retrieve_context_batch(cleaned, top_k=1)
+            # One batched top-k pass; its context is reused for the prompt
+            results = self.rag.retrieve_context_batch(cleaned)
             
             for item in results:
-                scored_ingredients.append({
-                    "ingredient": item["ingredient"],
-                    "score": item["similarity_score"]
-                })
+                scored_ingredients.append(scored_item(item))
         except Exception as e:
             print(f"Batch scoring failed: {e}")
             # Fallback to empty if batch fails
@@ -84,25 +275,157 @@ class FoodAnalysisPipeline:
         scored_ingredients.sort(key=lambda x: x["score"], reverse=True)
 
         # Step 6: Pick top N MOST CONFIDENT
-        selected_ingredients = [
-            item["ingredient"]
-            for item in scored_ingredients[:MAX_INGREDIENTS]
-        ]
+        selected = scored_ingredients[:MAX_INGREDIENTS]
+        selected_ingredients = [item["ingredient"] for item in selected]
+
+        yield "ingredients_detected", selected_ingredients
 
-        # Step 7: Batched RAG explanation (SINGLE call)
+        # Step 7: Stored explanations + batched RAG for the rest (at most ONE call)
+        indices = []
         try:
-            analysis = self.rag.explain_ingredients_batch(selected_ingredients, language=language)
+            analysis = yield from tagged("explanation", recorded(
+                self.iter_explanations(selected, language=language, stream=stream), indices
+            ))
         except Exception as e:
             return {
                 "success": False,
-                "error": "Analysis failed or timed out",
+                "error": EXPLANATION_FAILED,
                 "ingredients": selected_ingredients
             }
 
         # Step 8: Final response
-        return {
+        result = {
             "success": True,
             "raw_text": raw_text,
             "ingredients_detected": selected_ingredients,
             "analysis": analysis
         }
+        # Raw LLM output that did not parse is not worth replaying
+        if indices:
+            analysis_cache.set(fingerprint, (result, sorted(indices)), variant=variant)
+        return dict(result)
+
+    def analyze_batch(self, products: List[List[bytes]], language: str = "en") -> List[Dict]:
+        """
+        Analyze several products, each photographed one or more times
+        (front, back, side...). OCR runs for all images in parallel;
+        ingredients are merged and deduplicated per product; retrieval is one
+        batched pass over every product's ingredients; each product then
+        gets at most one explanation LLM call. Returns one result per product.
+        """
+        # Step 1: OCR every distinct image in parallel (identical uploads once)
+        product_fingerprints = [[image_fingerprint(b) for b in product] for product in products]
+        images = {}
+        for product, fingerprints in zip(products, product_fingerprints):
+            for image_bytes, fingerprint in zip(product, fingerprints):
+                images.setdefault(fingerprint, image_bytes)
+
+        def ocr(item):
+            # One unreadable image must not cost the other products their result
+            fingerprint, image_bytes = item
+            try:
+                return extract_text_from_image(image_bytes, fingerprint=fingerprint), None
+            except Exception as e:
+                print(f"Batch OCR failed: {e}")
+                return None, e
+
+        # Bounded by the OCR pool size so one batch cannot overflow its queue
+        with ThreadPoolExecutor(max_workers=max(1, min(len(images), OCR_WORKERS))) as pool:
+            outcomes = dict(zip(images, pool.map(ocr, images.items())))
+        texts = {fp: text for fp, (text, error) in outcomes.items() if error is None}
+        errors = {fp: error for fp, (text, error) in outcomes.items() if error is not None}
+
+        # Nothing was read at all: let the router answer 503 / 504 as for /analyze
+        if errors and not texts:
+            raise next(iter(errors.values()))
+
+        # Step 2: Merge + deduplicate ingredients per product
+        product_texts = []
+        product_ingredients = []
+        product_errors = []
+        for fingerprints in product_fingerprints:
+            product_errors.append([
+                {"image": i, "error": str(errors[fp])}
+                for i, fp in enumerate(fingerprints) if fp in errors
+            ])
+            raw_texts = list(dict.fromkeys(texts[fp] for fp in fingerprints if fp in texts))
+            raw_texts = [t for t in raw_texts if t and t.strip()]
+            product_texts.append(raw_texts)
+            product_ingredients.append(list(dict.fromkeys(
+                ing for text in raw_texts for ing in relevant_ingredients(text)
+            )))
+
+        # Step 3: ONE retrieval pass for every ingredient of every product
+        unique = list(dict.fromkeys(ing for names in product_ingredients for ing in names))
+        try:
+            matches = {m["ingredient"]: scored_item(m) for m in self.rag.retrieve_context_batch(unique)}
+        except Exception as e:
+            print(f"Batch scoring failed: {e}")
+            matches = {}
+
+        # Step 4: Top N per product, one doc per slot across the photos
+        selections = []
+        for names in product_ingredients:
+            scored = sorted(
+                (matches[name] for name in names if name in matches),
+                key=lambda x: x["score"], reverse=True
+            )
+            selected, docs = [], set()
+            for item in scored:
+                if item["matched_ingredient"] in docs:
+                    continue
+                docs.add(item["matched_ingredient"])
+                selected.append(item)
+            selections.append(selected[:MAX_INGREDIENTS])
+
+        # Step 5: One explanation call per product, products in parallel
+        def explain(selected: List[Dict]) -> Optional[str]:
+            if not selected:
+                return None
+            try:
+                return self.explain_selected(selected, language=language)
+            except Exception as e:
+                print(f"Batch explanation failed: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(len(products), BATCH_EXPLAIN_WORKERS))) as pool:
+            analyses = list(pool.map(explain, selections))
+
+        # Step 6: Final responses, same shape as analyze_image
+        results = []
+        for fingerprints, image_errors, raw_texts, names, selected, analysis in zip(
+                product_fingerprints, product_errors, product_texts,
+                product_ingredients, selections, analyses):
+            selected_ingredients = [item["ingredient"] for item in selected]
+            if len(image_errors) == len(fingerprints):
+                results.append({"success": False, "error": image_errors[0]["error"]})
+            elif not raw_texts:
+                results.append({"success": False, "error": "No text detected in image"})
+            elif not names:
+                results.append({
+                    "success": True,
+                    "ingredients": [],
+                    "message": "No recognizable ingredients found"
+                })
+            elif not selected:
+                results.append({
+                    "success": True,
+                    "ingredients": [],
+                    "message": "No ingredients matched knowledge base with confidence"
+                })
+            elif analysis is None:
+                results.append({
+                    "success": False,
+                    "error": EXPLANATION_FAILED,
+                    "ingredients": selected_ingredients
+                })
+            else:
+                results.append({
+                    "success": True,
+                    "raw_text": "\n\n".join(raw_texts),
+                    "ingredients_detected": selected_ingredients,
+                    "analysis": analysis
+                })
+            if image_errors:
+                results[-1]["image_errors"] = image_errors
+        return results
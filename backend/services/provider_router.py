@@ -0,0 +1,214 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import List, Optional, Sequence, Tuple
+
+TTS_BREAKER_FAILURES = int(os.getenv("TTS_BREAKER_FAILURES", "3"))  # consecutive, to open
+TTS_BREAKER_COOLDOWN = float(os.getenv("TTS_BREAKER_COOLDOWN", "30"))  # seconds open before a probe
+TTS_LATENCY_WINDOW = int(os.getenv("TTS_LATENCY_WINDOW", "50"))  # calls kept per provider
+# Seconds a request may spend waiting for the first audio before falling back
+TTS_DEADLINE = float(os.getenv("TTS_DEADLINE", "6"))
+# Share of recent calls failing above which a provider is tried after the others
+TTS_MAX_ERROR_RATE = float(os.getenv("TTS_MAX_ERROR_RATE", "0.5"))
+MIN_SAMPLES = 5  # calls needed before latency or errors affect the provider order
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class CircuitBreaker:
+    """
+    closed: calls pass. After `failures` consecutive errors -> open.
+    open: calls are refused for `cooldown` seconds, then -> half_open.
+    half_open: one probe call is let through; success closes, failure re-opens.
+    """
+
+    def __init__(self, failures: int = TTS_BREAKER_FAILURES, cooldown: float = TTS_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        return False
+
+    def success(self):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+
+    def failure(self):
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failures:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """The call was cancelled before a verdict; free the probe slot."""
+        self.probe_in_flight = False
+
+    def stats(self) -> dict:
+        retry_in = 0.0
+        if self.state == OPEN:
+            retry_in = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "probe_in_seconds": round(retry_in, 1),
+        }
+
+
+class ProviderHealth:
+    """Rolling latency (time to first audio) and error rate for one provider."""
+
+    def __init__(self, window: int = TTS_LATENCY_WINDOW):
+        self.calls = deque(maxlen=window)  # (latency or None, ok)
+        self.breaker = CircuitBreaker()
+        self.total_calls = 0
+        self.total_errors = 0
+        self.timeouts = 0
+        self.last_call = 0.0
+
+    def latencies(self) -> List[float]:
+        return [latency for latency, ok in self.calls if ok]
+
+    def error_rate(self) -> float:
+        if not self.calls:
+            return 0.0
+        return sum(1 for _, ok in self.calls if not ok) / len(self.calls)
+
+    def stats(self) -> dict:
+        latencies = self.latencies()
+        p50 = percentile(latencies, 50)
+        p95 = percentile(latencies, 95)
+        return {
+            "calls": self.total_calls,
+            "errors": self.total_errors,
+            "timeouts": self.timeouts,
+            "error_rate": round(self.error_rate(), 3),
+            "p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+            "breaker": self.breaker.stats(),
+        }
+
+
+class ProviderRouter:
+    """
+    Orders TTS providers for each request and gates them through a
+    per-provider circuit breaker. Providers keep their configured
+    preference unless their rolling p95 no longer fits the request deadline
+    or most of their recent calls failed; then they go last.
+    """
+
+    def __init__(self, deadline: float = TTS_DEADLINE):
+        self.deadline = deadline
+        self._health = {}
+        self._lock = threading.RLock()
+        self.failovers = 0
+
+    def health(self, provider: str) -> ProviderHealth:
+        with self._lock:
+            if provider not in self._health:
+                self._health[provider] = ProviderHealth()
+            return self._health[provider]
+
+    def _stale(self, provider: str) -> bool:
+        # A demoted provider is rarely called, so its numbers stop updating;
+        # after a cooldown it gets its place back until it is measured again
+        return time.monotonic() - self.health(provider).last_call >= TTS_BREAKER_COOLDOWN
+
+    def _too_slow(self, provider: str) -> bool:
+        latencies = self.health(provider).latencies()
+        if len(latencies) < MIN_SAMPLES or self._stale(provider):
+            return False
+        return percentile(latencies, 95) > self.deadline
+
+    def _unreliable(self, provider: str) -> bool:
+        # Intermittent errors never open the breaker (successes reset it)
+        health = self.health(provider)
+        if len(health.calls) < MIN_SAMPLES or self._stale(provider):
+            return False
+        return health.error_rate() > TTS_MAX_ERROR_RATE
+
+    def order(self, plan: List[Tuple[str, str, str]]) -> List[Tuple[str, str, str]]:
+        """
+        Reorder (provider, voice, format) entries, keeping the configured
+        order among equally healthy ones. A slow or unreliable provider goes
+        behind the configured fallback too: it then only runs, without a
+        deadline, once the others have failed.
+        """
+        if len(plan) < 2:
+            return plan
+        with self._lock:
+            return sorted(
+                plan,
+                key=lambda entry: self._too_slow(entry[0]) or self._unreliable(entry[0])
+            )
+
+    def allow(self, provider: str, last_resort: bool = False) -> bool:
+        with self._lock:
+            allowed = self.health(provider).breaker.allow()
+        # The fallback always runs: there is nothing left to fail over to
+        return allowed or last_resort
+
+    def success(self, provider: str, latency: float):
+        health = self.health(provider)
+        with self._lock:
+            health.calls.append((latency, True))
+            health.total_calls += 1
+            health.last_call = time.monotonic()
+            health.breaker.success()
+
+    def failure(self, provider: str, error: Exception, timeout: bool = False):
+        health = self.health(provider)
+        with self._lock:
+            health.calls.append((None, False))
+            health.total_calls += 1
+            health.last_call = time.monotonic()
+            health.total_errors += 1
+            if timeout:
+                health.timeouts += 1
+            was_open = health.breaker.state == OPEN
+            health.breaker.failure()
+            opened = not was_open and health.breaker.state == OPEN
+        if opened:
+            print(f"[WARNING] TTS provider {provider} disabled for {health.breaker.cooldown:.0f}s: {error}")
+        else:
+            print(f"[WARNING] TTS provider {provider} failed: {error}")
+
+    def abandon(self, provider: str):
+        with self._lock:
+            self.health(provider).breaker.abandon()
+
+    def stats(self) -> dict:
+        with self._lock:
+            providers = dict(self._health)
+        return {
+            "deadline_seconds": self.deadline,
+            "failovers": self.failovers,
+            "providers": {name: health.stats() for name, health in providers.items()},
+        }
@@ -1,13 +1,135 @@
 import os
-from typing import List, Dict
+import json
+import asyncio
+from typing import List, Dict, Optional, Iterator, Tuple
 
 from dotenv import load_dotenv
-from openai import OpenAI
+import httpx
+from openai import OpenAI, AsyncOpenAI
 
-from services.vector_store import VectorStore
+from services.vector_store import VectorStore, normalize_query
+from services.lexical_index import LexicalIndex
+from services.explanation_store import normalize_language
+from services.single_flight import SingleFlight, AsyncSingleFlight
+from services.response_cache import SemanticResponseCache, history_matters, query_language
 
 load_dotenv()
 
+LLM_BASE_URL = "https://models.github.ai/inference"
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+CHAT_HISTORY_TURNS = 5  # Turns of history included in the chat prompt
+RETRIEVAL_TOP_K = 3  # Docs per ingredient given to the explanation prompt
+CORRECTED_MATCH_SCORE = 0.9  # Confidence given to a spelling-corrected match
+
+
+def _llm_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=60,
+    )
+
+
+def explain_key(
+    ingredients: List[str],
+    language: str,
+    contexts: Optional[Dict[str, List[Dict]]] = None,
+) -> Tuple:
+    """
+    Identity of an explain request: the ingredient names in prompt order,
+    the language and any pinned context docs. Order is part of the key
+    because the pipeline falls back to prompt order for results the model
+    renamed, so a shared answer must come from the same prompt order.
+    """
+    contexts = contexts or {}
+    items = tuple(
+        (name.strip().lower(), tuple(block["ingredient"] for block in contexts.get(name) or ()))
+        for name in ingredients
+    )
+    return ("explain", items, normalize_language(language))
+
+
+def chat_key(history: List[Dict], query: str) -> Tuple:
+    """Identity of a chat request: the normalized query plus the history the prompt uses."""
+    recent = tuple((m["role"], m["content"]) for m in history[-CHAT_HISTORY_TURNS:])
+    return ("chat", normalize_query(query), recent)
+
+
+def parse_results(content: str) -> List[Dict]:
+    """
+    Parse the {"results": [...]} JSON returned by explain_ingredients_batch,
+    tolerating markdown code fences. Raises ValueError on malformed output.
+    """
+    clean_json = content.replace("```json", "").replace("```", "").strip()
+    parsed = json.loads(clean_json)
+
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("results"), list):
+        raise ValueError("LLM response has no 'results' list")
+    return parsed["results"]
+
+
+class ResultStreamParser:
+    """
+    Incrementally pulls complete objects out of a streamed {"results": [...]}
+    response, so each explanation can be emitted as soon as it is closed.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._in_results = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._start = None
+
+    def feed(self, chunk: str) -> List[Dict]:
+        self.buffer += chunk
+        completed = []
+
+        while self._pos < len(self.buffer):
+            ch = self.buffer[self._pos]
+
+            if not self._in_results:
+                # Wait for the opening bracket of the "results" array
+                key = self.buffer.find('"results"', 0, self._pos + 1)
+                if key != -1 and ch == "[":
+                    self._in_results = True
+                self._pos += 1
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._start = self._pos
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._start is not None:
+                    try:
+                        item = json.loads(self.buffer[self._start:self._pos + 1])
+                        if isinstance(item, dict):
+                            completed.append(item)
+                    except ValueError:
+                        pass
+                    self._start = None
+            elif ch == "]" and self._depth == 0:
+                self._in_results = False
+
+            self._pos += 1
+
+        return completed
+
 
 class RAGEngine:
     """
@@ -17,66 +139,150 @@ class RAGEngine:
 
     def __init__(self):
         self.vector_store = VectorStore()
+        self.lexical_index = LexicalIndex(self.vector_store.documents)
+        self.retrieval_stats = {"lexical_hits": 0, "corrected_hits": 0, "vector_hits": 0}
+        self.documents_by_name = {
+            doc["ingredient"]: doc for doc in self.vector_store.documents
+        }
 
         api_key = os.getenv("GITHUB_TOKEN_FINE")
         if not api_key:
             raise RuntimeError("GITHUB_TOKEN_FINE is not set")
 
+        # One tuned connection pool per client, shared by every request:
+        # the sync client serves the pipeline threads, the async one the routes
         self.client = OpenAI(
             api_key=api_key,
-            base_url="https://models.github.ai/inference",
+            base_url=LLM_BASE_URL,
+            http_client=httpx.Client(limits=_llm_limits(), timeout=LLM_TIMEOUT),
+        )
+        self.async_client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=LLM_BASE_URL,
+            http_client=httpx.AsyncClient(limits=_llm_limits(), timeout=LLM_TIMEOUT),
         )
 
-    def retrieve_context(self, ingredient: str, top_k: int = 3) -> List[Dict]:
+        # Identical requests already in flight wait for that call instead of
+        # sending their own (bursts of the same scan or question)
+        self.inflight = SingleFlight()
+        self.async_inflight = AsyncSingleFlight()
+        # Answers to near-duplicate chat questions, reused without an LLM call
+        self.chat_cache = SemanticResponseCache()
+
+    @staticmethod
+    def _context_block(doc: Dict) -> Dict:
+        return {
+            "ingredient": doc["ingredient"],
+            "role": doc["role"],
+            "summary": doc["summary"],
+            "evidence": doc["evidence"],
+            "similarity_score": round(doc["confidence_score"], 2),
+        }
+
+    def retrieve_context(self, ingredient: str, top_k: int = RETRIEVAL_TOP_K) -> List[Dict]:
         results = self.vector_store.search(ingredient, top_k=top_k)
-
-        return [
-            {
-                "ingredient": doc["ingredient"],
-                "role": doc["role"],
-                "summary": doc["summary"],
-                "evidence": doc["evidence"],
-                "similarity_score": round(doc["confidence_score"], 2),
-            }
-            for doc in results
-        ]
-
-    def retrieve_context_batch(self, ingredients: List[str], top_k: int = 1) -> List[Dict]:
+        return [self._context_block(doc) for doc in results]
+
+    def get_document(self, name: str) -> Optional[Dict]:
+        return self.documents_by_name.get(name)
+
+    @staticmethod
+    def document_context(doc: Dict) -> Dict:
+        return {
+            "ingredient": doc["ingredient"],
+            "role": doc["role"],
+            "summary": doc["summary"],
+            "evidence": doc["evidence"],
+            "similarity_score": 1.0,
+        }
+
+    def retrieve_context_batch(self, ingredients: List[str], top_k: int = RETRIEVAL_TOP_K) -> List[Dict]:
         """
         Batch retrieve context for multiple ingredients.
-        Returns a flat list of best matches for scoring.
+        Returns a flat list of best matches for scoring, each carrying its
+        prompt "context" blocks so explanation needs no second retrieval.
+        Exact names and aliases are resolved lexically, then OCR typos by
+        spelling correction; only the rest are sent to the vector store,
+        in one top_k pass.
         """
-        batch_results = self.vector_store.search_batch(ingredients, top_k=top_k)
-        
+        matches = [None] * len(ingredients)
+        unresolved = []
+
+        for i, ingredient in enumerate(ingredients):
+            doc = self.lexical_index.lookup(ingredient)
+            if doc is not None:
+                matches[i] = (doc, 1.0, "lexical")
+                continue
+            doc = self.lexical_index.correct(ingredient)
+            if doc is not None:
+                matches[i] = (doc, CORRECTED_MATCH_SCORE, "corrected")
+            else:
+                unresolved.append(i)
+
+        if unresolved:
+            batch_results = self.vector_store.search_batch(
+                [ingredients[i] for i in unresolved], top_k=top_k
+            )
+            for i, results in zip(unresolved, batch_results):
+                if results:
+                    # Take the top match for each ingredient; all top_k are context
+                    doc = results[0]
+                    context = [self._context_block(r) for r in results]
+                    matches[i] = (doc, doc["confidence_score"], "vector", context)
+
         flat_results = []
-        for i, results in enumerate(batch_results):
-            if results:
-                # Take the top match for each ingredient
-                doc = results[0]
-                flat_results.append({
-                    "ingredient": ingredients[i], # Use original name
-                    "role": doc["role"],
-                    "evidence": doc["evidence"],
-                    "similarity_score": round(doc["confidence_score"], 2)
-                })
+        for i, match in enumerate(matches):
+            if match is None:
+                continue
+            doc, score, match_type = match[:3]
+            # An exact, alias or corrected match is grounded in that doc alone
+            context = match[3] if match_type == "vector" else [self.document_context(doc)]
+            self.retrieval_stats[f"{match_type}_hits"] += 1
+            flat_results.append({
+                "ingredient": ingredients[i], # Use original name
+                "matched_ingredient": doc["ingredient"],
+                "role": doc["role"],
+                "evidence": doc["evidence"],
+                "similarity_score": round(score, 2),
+                "match_type": match_type,
+                "context": context,
+            })
         return flat_results
 
-    def explain_ingredients_batch(self, ingredients: List[str], language: str = "en") -> Dict:
+    def _explain_messages(
+        self,
+        ingredients: List[str],
+        language: str = "en",
+        contexts: Optional[Dict[str, List[Dict]]] = None,
+    ) -> List[Dict]:
         """
-        Explain multiple ingredients in ONE call, but with strict separation.
+        Build the strict, per-ingredient grounded prompt.
+        `contexts` supplies the context blocks per ingredient (from
+        retrieve_context_batch, or a single pinned knowledge doc); only
+        ingredients without one are retrieved here. A doc shared by several
+        ingredients is written out once and referenced after that.
         """
+        contexts = contexts or {}
 
         ingredient_sections = []
+        written_docs = set()
 
         for ingredient in ingredients:
-            context_blocks = self.retrieve_context(ingredient)
-
-            context_text = "\n".join(
-                f"- Role: {b['role']}\n"
-                f"- Evidence: {b['evidence']}\n"
-                f"- Summary: {b['summary']}"
-                for b in context_blocks
-            )
+            context_blocks = contexts.get(ingredient) or self.retrieve_context(ingredient)
+
+            lines = []
+            for b in context_blocks:
+                if b["ingredient"] in written_docs:
+                    lines.append(f"[{b['ingredient']}] (same facts as above)")
+                    continue
+                written_docs.add(b["ingredient"])
+                lines.append(
+                    f"[{b['ingredient']}]\n"
+                    f"- Role: {b['role']}\n"
+                    f"- Evidence: {b['evidence']}\n"
+                    f"- Summary: {b['summary']}"
+                )
+            context_text = "\n".join(lines)
 
             ingredient_sections.append(
                 f"""
@@ -123,12 +329,35 @@ CONTEXT:
 {full_context}
 """
 
+        return [
+            {"role": "system", "content": "You are a strict, grounded AI. Obey the rules exactly."},
+            {"role": "user", "content": prompt},
+        ]
+
+    def explain_ingredients_batch(
+        self,
+        ingredients: List[str],
+        language: str = "en",
+        contexts: Optional[Dict[str, List[Dict]]] = None,
+    ) -> str:
+        """
+        Explain multiple ingredients in ONE call, but with strict separation.
+        Concurrent identical requests share one upstream call.
+        """
+        return self.inflight.do(
+            explain_key(ingredients, language, contexts),
+            self._explain_ingredients_batch, ingredients, language, contexts
+        )
+
+    def _explain_ingredients_batch(
+        self,
+        ingredients: List[str],
+        language: str,
+        contexts: Optional[Dict[str, List[Dict]]],
+    ) -> str:
         response = self.client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a strict, grounded AI. Obey the rules exactly."},
-                {"role": "user", "content": prompt},
-            ],
+            messages=self._explain_messages(ingredients, language, contexts),
             temperature=0.1,
             timeout=30,
         )
@@ -137,29 +366,44 @@ CONTEXT:
         print(f"DEBUG: Raw RAG response:\n{content}")
         return content
 
-    def chat_completion(self, history: List[Dict], query: str) -> str:
+    def stream_ingredients_batch(
+        self,
+        ingredients: List[str],
+        language: str = "en",
+        contexts: Optional[Dict[str, List[Dict]]] = None,
+    ) -> Iterator[str]:
         """
-        Handle chat queries with history context.
+        Same call as explain_ingredients_batch, streamed.
+        Yields text deltas as they arrive; feed them to ResultStreamParser.
         """
-        # 1. Retrieve Knowledge based on current query
-        # We search specifically for the LAST user query to get relevant ingredients/facts
-        context_docs = self.vector_store.search(query, top_k=3)
-        
+        stream = self.client.chat.completions.create(
+            model="gpt-4o",
+            messages=self._explain_messages(ingredients, language, contexts),
+            temperature=0.1,
+            timeout=30,
+            stream=True,
+        )
+
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _chat_messages(self, context_docs: List[Dict], history: List[Dict], query: str) -> List[Dict]:
         knowledge_text = "\n".join(
             f"- {doc['ingredient']} ({doc['role']}): {doc['summary']}"
             for doc in context_docs
         )
 
-        # 2. Format History
+        # Format History
         # history is expected to be [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]
         # We take the last 5 turns to keep context window manageable
-        recent_history = history[-5:]
+        recent_history = history[-CHAT_HISTORY_TURNS:]
         history_text = ""
         for msg in recent_history:
             role = "User" if msg["role"] == "user" else "Assistant"
             history_text += f"{role}: {msg['content']}\n"
 
-        # 3. Construct Prompt
+        # Construct Prompt
         prompt = f"""
 You are FoodLens AI, a helpful nutrition assistant using simple words.
 
@@ -182,22 +426,80 @@ INSTRUCTIONS:
 - END WITH A SUGGESTION.
 """
 
+        return [
+            {"role": "system", "content": "You are a helpful nutrition assistant."},
+            {"role": "user", "content": prompt},
+        ]
+
+    def chat_completion(self, history: List[Dict], query: str) -> str:
+        """
+        Handle chat queries with history context.
+        Blocking; async routes should use achat_completion.
+        """
+        return self.inflight.do(chat_key(history, query), self._chat_completion, history, query)
+
+    def _chat_context(self, history: List[Dict], query: str):
+        """
+        Retrieve the knowledge docs for a chat query and look for a cached
+        answer. Returns (context_docs, cached answer or None, cache slot to
+        store the new answer under, or None when history matters).
+        """
+        # 1. Retrieve Knowledge based on current query
+        # We search specifically for the LAST user query to get relevant ingredients/facts
+        context_docs = self.vector_store.search(query, top_k=3)
+
+        if history_matters(history, query):
+            self.chat_cache.skip()
+            return context_docs, None, None
+
+        # Already in the query embedding cache from the search above
+        embedding = self.vector_store.embed_queries([query])[0]
+        scope = self.chat_cache.scope(query_language(query), context_docs)
+        return context_docs, self.chat_cache.get(scope, embedding), (scope, embedding)
+
+    def _chat_completion(self, history: List[Dict], query: str) -> str:
+        context_docs, cached, slot = self._chat_context(history, query)
+        if cached is not None:
+            return cached
+
         response = self.client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful nutrition assistant."},
-                {"role": "user", "content": prompt},
-            ],
+            messages=self._chat_messages(context_docs, history, query),
             temperature=0.3, # Slightly higher for more natural conversation
             timeout=30,
         )
 
-        return response.choices[0].message.content.strip()
+        answer = response.choices[0].message.content.strip()
+        if slot is not None:
+            self.chat_cache.set(*slot, answer)
+        return answer
 
-    def generate_title(self, text: str) -> str:
+    async def achat_completion(self, history: List[Dict], query: str) -> str:
         """
-        Generate a short title for the chat session based on the first message.
+        Async chat_completion: the embedding lookup runs in a worker thread
+        and the LLM call awaits on the shared async HTTP pool.
         """
+        return await self.async_inflight.do(chat_key(history, query), self._achat_completion, history, query)
+
+    async def _achat_completion(self, history: List[Dict], query: str) -> str:
+        context_docs, cached, slot = await asyncio.to_thread(self._chat_context, history, query)
+        if cached is not None:
+            return cached
+
+        response = await self.async_client.chat.completions.create(
+            model="gpt-4o",
+            messages=self._chat_messages(context_docs, history, query),
+            temperature=0.3, # Slightly higher for more natural conversation
+            timeout=30,
+        )
+
+        answer = response.choices[0].message.content.strip()
+        if slot is not None:
+            self.chat_cache.set(*slot, answer)
+        return answer
+
+    @staticmethod
+    def _title_messages(text: str) -> List[Dict]:
         prompt = f"""
         Generate a short, concise title (max 5 words) for a chat that starts with: "{text}".
         Do not use quotes. Just the title.
@@ -207,13 +509,19 @@ INSTRUCTIONS:
         - "Banana Calories"
         """
 
+        return [
+            {"role": "system", "content": "You are a helpful assistant. Keep it brief."},
+            {"role": "user", "content": prompt},
+        ]
+
+    def generate_title(self, text: str) -> str:
+        """
+        Generate a short title for the chat session based on the first message.
+        """
         try:
             response = self.client.chat.completions.create(
                 model="openai/gpt-4.1",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant. Keep it brief."},
-                    {"role": "user", "content": prompt},
-                ],
+                messages=self._title_messages(text),
                 temperature=0.5,
                 max_tokens=15,
                 timeout=10,
@@ -222,3 +530,21 @@ INSTRUCTIONS:
         except Exception as e:
             print(f"Title generation failed: {e}")
             return "Chat Session"
+
+    async def agenerate_title(self, text: str) -> str:
+        try:
+            response = await self.async_client.chat.completions.create(
+                model="openai/gpt-4.1",
+                messages=self._title_messages(text),
+                temperature=0.5,
+                max_tokens=15,
+                timeout=10,
+            )
+            return response.choices[0].message.content.strip().replace('"', '')
+        except Exception as e:
+            print(f"Title generation failed: {e}")
+            return "Chat Session"
+
+    async def aclose(self):
+        await self.async_client.close()
+        self.client.close()
@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+from services.vector_store import normalize_query
+
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "1000"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "21600"))  # 6 hours
+# Cosine similarity (normalized query embeddings) needed to reuse an answer
+CHAT_CACHE_THRESHOLD = float(os.getenv("CHAT_CACHE_THRESHOLD", "0.85"))
+
+# Words that make a question lean on earlier turns ("is it safe?", "tell me more")
+FOLLOWUP_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their",
+    "one", "ones", "above", "same", "more", "else", "also", "which",
+    "यह", "ये", "वह", "वो", "इसे", "इसका", "इसकी", "इसके", "उसका", "उसकी", "उसके",
+    "इन", "उन", "इनमें", "उनमें", "और",
+}
+FOLLOWUP_MAX_WORDS = 3  # Very short questions ("why?", "how much?") are follow-ups too
+
+
+def query_language(query: str) -> str:
+    """Chat answers in the language of the question: Devanagari -> Hindi."""
+    return "hi" if any(0x0900 <= ord(c) <= 0x097F for c in query) else "en"
+
+
+def history_matters(history: List[Dict], query: str) -> bool:
+    """
+    True when the answer probably depends on earlier turns: the session has
+    prior messages and the question is a follow-up.
+    """
+    prior = list(history)
+    if prior and prior[-1]["role"] == "user" and prior[-1]["content"] == query:
+        prior.pop()  # The chat route already appended the current question
+    if not prior:
+        return False
+
+    words = [w.strip("?.!,;:'\"") for w in normalize_query(query).split()]
+    return len(words) <= FOLLOWUP_MAX_WORDS or any(w in FOLLOWUP_WORDS for w in words)
+
+
+class SemanticResponseCache:
+    """
+    Chat answers reused for near-duplicate questions. An entry matches when
+    its question embedding is within CHAT_CACHE_THRESHOLD of the new one and
+    it was grounded in the same knowledge docs, in the same language.
+    Entries expire after CHAT_CACHE_TTL; beyond CHAT_CACHE_SIZE the least
+    recently used is dropped.
+    """
+
+    def __init__(self, maxsize: int = CHAT_CACHE_SIZE, ttl: float = CHAT_CACHE_TTL,
+                 threshold: float = CHAT_CACHE_THRESHOLD):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        # entry id -> (scope, embedding, answer, stored_at)
+        self._entries = OrderedDict()
+        self._scopes = {}  # (language, docs) -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def scope(language: str, context_docs: List[Dict]) -> Tuple[str, frozenset]:
+        return (language, frozenset(doc["ingredient"] for doc in context_docs))
+
+    def _drop(self, entry_id: int):
+        scope = self._entries.pop(entry_id)[0]
+        ids = self._scopes[scope]
+        ids.discard(entry_id)
+        if not ids:
+            del self._scopes[scope]
+
+    def get(self, scope: Tuple[str, frozenset], embedding: np.ndarray) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._scopes.get(scope, ())):
+                _, stored, _, stored_at = self._entries[entry_id]
+                if now - stored_at > self.ttl:
+                    self._drop(entry_id)
+                    self.expirations += 1
+                    continue
+                score = float(np.dot(stored, embedding))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][2]
+
+    def set(self, scope: Tuple[str, frozenset], embedding: np.ndarray, answer: str):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (scope, np.array(embedding, dtype=np.float32), answer, time.monotonic())
+            self._scopes.setdefault(scope, set()).add(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def skip(self):
+        """Count a request that bypassed the cache because history matters."""
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
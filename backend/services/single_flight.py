@@ -0,0 +1,94 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls from threads: the first caller for
+    a key runs the function, callers arriving while it is in flight wait
+    and get the same result (or exception). Nothing is kept afterwards.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> [done event, result, error]
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = [threading.Event(), None, None]
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+
+        try:
+            call[1] = fn(*args, **kwargs)
+            return call[1]
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+
+    def stats(self) -> dict:
+        total = self.leaders + self.shared
+        return {
+            "in_flight": len(self._calls),
+            "upstream_calls": self.leaders,
+            "coalesced": self.shared,
+            "coalesced_rate": round(self.shared / total, 3) if total else 0.0,
+        }
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop. The shared call runs as
+    its own task, so a caller being cancelled does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._tasks[key] = task
+            self.leaders += 1
+
+            def finished(t: asyncio.Task):
+                if self._tasks.get(key) is t:
+                    del self._tasks[key]
+                if not t.cancelled():
+                    t.exception()  # Retrieved here so an abandoned call doesn't warn
+
+            task.add_done_callback(finished)
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        total = self.leaders + self.shared
+        return {
+            "in_flight": len(self._tasks),
+            "upstream_calls": self.leaders,
+            "coalesced": self.shared,
+            "coalesced_rate": round(self.shared / total, 3) if total else 0.0,
+        }
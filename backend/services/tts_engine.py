@@ -0,0 +1,417 @@
+import os
+import re
+import time
+import asyncio
+from collections import OrderedDict
+from typing import AsyncIterator, List, Optional, Tuple
+
+import edge_tts
+from elevenlabs.client import ElevenLabs
+from starlette.concurrency import iterate_in_threadpool
+
+from services.audio_cache import AudioCache, audio_cache_key
+from services.provider_router import ProviderRouter
+
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4"))
+# Segments of one request synthesized at the same time
+TTS_SEGMENT_FANOUT = int(os.getenv("TTS_SEGMENT_FANOUT", "4"))
+SEGMENT_MIN_CHARS = 40  # Shorter sentences are merged into the next one
+# A prefetched clip nobody asked for within this many seconds counts as wasted
+TTS_PREFETCH_TTL = float(os.getenv("TTS_PREFETCH_TTL", "300"))
+PREFETCH_MAX_TRACKED = 1024
+
+DEFAULT_VOICE_ID = "RABOvaPec1ymXz02oDQi"
+
+# Sentence ends: . ! ? and the Devanagari danda, followed by whitespace
+SENTENCE_END_RE = re.compile(r"(?<=[.!?\u0964])\s+")
+
+ELEVENLABS_MODEL = "eleven_multilingual_v2"
+ELEVENLABS_FORMAT = "mp3_44100_128"
+EDGE_FORMAT = "audio-24khz-48kbitrate-mono-mp3"  # edge-tts default output
+
+
+def edge_voice_for(text: str) -> str:
+    is_hindi = any(0x0900 <= ord(c) <= 0x097F for c in text)
+    return "hi-IN-SwaraNeural" if is_hindi else "en-US-AvaNeural"
+
+
+def split_segments(text: str, min_chars: int = SEGMENT_MIN_CHARS) -> List[str]:
+    """
+    Split speech text into sentence segments. Short pieces (e.g. an
+    ingredient name read as "Sugar.") are merged forward, so each segment is
+    worth a provider round trip and common segments repeat across analyses.
+    """
+    segments = []
+    pending = ""
+    for sentence in SENTENCE_END_RE.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        pending = f"{pending} {sentence}".strip()
+        if len(pending) >= min_chars:
+            segments.append(pending)
+            pending = ""
+
+    if pending:
+        if segments and len(pending) < min_chars:
+            segments[-1] = f"{segments[-1]} {pending}"
+        else:
+            segments.append(pending)
+    return segments
+
+
+async def edge_tts_chunks(text: str, voice: str) -> AsyncIterator[bytes]:
+    communicate = edge_tts.Communicate(text, voice)
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            yield chunk["data"]
+
+
+class TTSEngine:
+    """
+    Text-to-speech with a content-addressed audio cache and a concurrency
+    limit (TTS_CONCURRENCY) instead of one global lock. Providers are
+    ordered and circuit-broken by a ProviderRouter; a provider that cannot
+    start producing audio within the request deadline is failed over.
+    """
+
+    def __init__(self, concurrency: int = TTS_CONCURRENCY):
+        self.cache = AudioCache()
+        self.concurrency = concurrency
+        self._semaphore = None
+        self._elevenlabs_client = None
+        self.router = ProviderRouter()
+
+        # Single-flight: request key -> task, so identical requests share one synthesis
+        self._inflight = {}
+        # Prefetched request keys not yet claimed by /tts -> start time
+        self._prefetched = OrderedDict()
+        self.prefetch_started = 0
+        self.prefetch_hits = 0
+        self.prefetch_joined = 0
+        self.prefetch_wasted = 0
+        self.prefetch_failed = 0
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it belongs to the server's event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def _elevenlabs(self):
+        api_key = os.getenv("ELEVENLABS_API_KEY")
+        if not api_key:
+            return None
+        if self._elevenlabs_client is None:
+            self._elevenlabs_client = ElevenLabs(api_key=api_key)
+        return self._elevenlabs_client
+
+    def plan(self, text: str, voice_id: str, edge_voice: Optional[str] = None) -> List[Tuple[str, str, str]]:
+        """(provider, voice, format) in preference order; Edge TTS is the fallback."""
+        providers = []
+        if os.getenv("ELEVENLABS_API_KEY"):
+            providers.append(("elevenlabs", voice_id, ELEVENLABS_FORMAT))
+        providers.append(("edge", edge_voice or edge_voice_for(text), EDGE_FORMAT))
+        return self.router.order(providers)
+
+    def provider_chunks(self, provider: str, text: str, voice: str) -> AsyncIterator[bytes]:
+        if provider == "elevenlabs":
+            return self._elevenlabs_chunks(text, voice)
+        return edge_tts_chunks(text, voice)
+
+    async def _elevenlabs_chunks(self, text: str, voice_id: str) -> AsyncIterator[bytes]:
+        # Some SDK versions open the HTTP request eagerly; keep it off the loop
+        audio_stream = await asyncio.to_thread(
+            self._elevenlabs().text_to_speech.convert,
+            text=text,
+            voice_id=voice_id,
+            model_id=ELEVENLABS_MODEL,
+            output_format=ELEVENLABS_FORMAT,
+            optimize_streaming_latency=3
+        )
+        # The SDK iterator blocks on the network; pull it from a worker thread
+        async for chunk in iterate_in_threadpool(audio_stream):
+            if chunk:
+                yield chunk
+
+    async def _provider_stream(self, provider: str, voice: str, text: str, key: str,
+                               acquired: Optional[asyncio.Event] = None) -> AsyncIterator[bytes]:
+        """
+        Forward one provider's chunks as they arrive and report the outcome
+        to the router. The complete audio is cached only once the provider
+        has finished. `acquired` is set once a synthesis slot is held.
+        """
+        chunks = []
+        first_audio = None
+        try:
+            async with self.semaphore:
+                if acquired is not None:
+                    acquired.set()
+                print(f"Generating {provider} TTS ({voice})...")
+                started = time.monotonic()
+                async for chunk in self.provider_chunks(provider, text, voice):
+                    if first_audio is None:
+                        first_audio = time.monotonic() - started
+                    chunks.append(chunk)
+                    yield chunk
+
+            # Collect chunks and join once (no quadratic re-copying)
+            audio = b"".join(chunks)
+            if not audio:
+                raise RuntimeError(f"{provider} returned no audio")
+        except Exception as e:
+            self.router.failure(provider, e)
+            raise
+        except BaseException:
+            # Cancelled by the deadline or a departed client: no verdict
+            self.router.abandon(provider)
+            raise
+
+        self.router.success(provider, first_audio)
+        await asyncio.to_thread(self.cache.put, key, audio)
+
+    async def _first_chunk(self, provider: str, chunks: AsyncIterator[bytes],
+                           acquired: asyncio.Event, timeout: Optional[float]) -> bytes:
+        """
+        Wait for a provider's first chunk, giving up `timeout` seconds after
+        the stream got its synthesis slot. Queueing behind our own
+        TTS_CONCURRENCY limit says nothing about the provider, so it neither
+        uses up the deadline nor counts as a provider failure.
+        """
+        if timeout is None:
+            return await chunks.__anext__()
+
+        first = asyncio.ensure_future(chunks.__anext__())
+        slot = asyncio.ensure_future(acquired.wait())
+        try:
+            await asyncio.wait({first, slot}, return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            first.cancel()
+            raise
+        finally:
+            slot.cancel()
+
+        try:
+            return await asyncio.wait_for(first, timeout)
+        except asyncio.TimeoutError:
+            error = TimeoutError(f"no audio within {self.router.deadline:.1f}s")
+            self.router.failure(provider, error, timeout=True)
+            raise error
+
+    async def _open(self, text: str, voice_id: str, edge_voice: Optional[str] = None,
+                    pin: Optional[str] = None) -> Tuple[bytes, Optional[AsyncIterator[bytes]], str]:
+        """
+        Walk the provider plan until one yields audio. Returns
+        (first audio, rest of the stream or None for a cache hit, provider).
+        Every provider but the last must start within the router deadline.
+        `pin` restricts the plan to that one provider (no failover).
+        """
+        plan = self.plan(text, voice_id, edge_voice)
+        if pin is not None:
+            plan = [entry for entry in plan if entry[0] == pin]
+            if not plan:
+                raise RuntimeError(f"TTS provider {pin} is not configured")
+        last_error = None
+
+        for i, (provider, voice, audio_format) in enumerate(plan):
+            key = audio_cache_key(text, voice, provider, audio_format)
+
+            audio = await asyncio.to_thread(self.cache.get, key)
+            if audio is not None:
+                return audio, None, provider
+
+            last_resort = i == len(plan) - 1
+            if not self.router.allow(provider, last_resort=last_resort):
+                continue
+
+            acquired = asyncio.Event()
+            chunks = self._provider_stream(provider, voice, text, key, acquired)
+            try:
+                first = await self._first_chunk(
+                    provider, chunks, acquired, None if last_resort else self.router.deadline
+                )
+            except Exception as e:
+                last_error = e
+                if not last_resort:
+                    self.router.failovers += 1
+                continue
+            return first, chunks, provider
+
+        raise RuntimeError(f"All TTS providers failed: {last_error}")
+
+    @staticmethod
+    def request_key(text: str, voice_id: str, edge_voice: Optional[str] = None) -> Tuple[str, str, str]:
+        return (text.strip(), voice_id, edge_voice or edge_voice_for(text))
+
+    async def _synthesize(self, text: str, voice_id: str, edge_voice: Optional[str],
+                          pin: Optional[str] = None) -> Tuple[bytes, str]:
+        first, rest, provider = await self._open(text, voice_id, edge_voice, pin)
+        if rest is None:
+            return first, provider
+        chunks = [first] + [chunk async for chunk in rest]
+        return b"".join(chunks), provider
+
+    def _join(self, text: str, voice_id: str, edge_voice: Optional[str],
+              pin: Optional[str] = None) -> asyncio.Task:
+        """The in-flight synthesis for this request, started if there is none."""
+        key = self.request_key(text, voice_id, edge_voice)
+        if pin is not None:
+            key += (pin,)  # Must not join an unpinned job on another provider
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._synthesize(text, voice_id, edge_voice, pin))
+            self._inflight[key] = task
+
+            def finished(t: asyncio.Task):
+                if self._inflight.get(key) is t:
+                    del self._inflight[key]
+                if not t.cancelled():
+                    t.exception()  # Retrieved here so an unawaited prefetch doesn't warn
+
+            task.add_done_callback(finished)
+        return task
+
+    def _claim_prefetch(self, key: Tuple[str, str, str]):
+        if self._prefetched.pop(key, None) is None:
+            return
+        self.prefetch_hits += 1
+        task = self._inflight.get(key)
+        if task is not None and not task.done():
+            self.prefetch_joined += 1
+
+    def _expire_prefetched(self):
+        now = time.monotonic()
+        while self._prefetched:
+            key, started = next(iter(self._prefetched.items()))
+            if now - started <= TTS_PREFETCH_TTL and len(self._prefetched) <= PREFETCH_MAX_TRACKED:
+                break
+            del self._prefetched[key]
+            self.prefetch_wasted += 1
+
+    def prefetch(self, text: str, voice_id: str = DEFAULT_VOICE_ID):
+        """
+        Start synthesizing `text` in the background so the /tts call that
+        usually follows an analysis is served from the cache or joins the
+        job. Must be called on the event loop.
+        """
+        if not text or not text.strip():
+            return
+        key = self.request_key(text, voice_id)
+        if key in self._prefetched:
+            return
+
+        self._expire_prefetched()
+        self._prefetched[key] = time.monotonic()
+        self.prefetch_started += 1
+
+        def failed(t: asyncio.Task):
+            if not t.cancelled() and t.exception() is not None:
+                self.prefetch_failed += 1
+                print(f"[WARNING] TTS prefetch failed: {t.exception()}")
+
+        self._join(text, voice_id, None).add_done_callback(failed)
+
+    async def synthesize(self, text: str, voice_id: str, edge_voice: Optional[str] = None,
+                         provider: Optional[str] = None) -> Tuple[bytes, str]:
+        """
+        Return (mp3 bytes, provider), from the cache when possible.
+        Concurrent calls for the same text share one synthesis. `provider`
+        pins the synthesis to one provider.
+        """
+        if provider is None:
+            self._claim_prefetch(self.request_key(text, voice_id, edge_voice))
+        # Shielded: a caller going away must not cancel the job for the others
+        return await asyncio.shield(self._join(text, voice_id, edge_voice, provider))
+
+    async def stream(self, text: str, voice_id: str) -> AsyncIterator[bytes]:
+        """
+        Yield audio chunks as the provider produces them, so playback can
+        start after the first chunk. Cached audio is yielded in one piece.
+        """
+        request_key = self.request_key(text, voice_id)
+        self._claim_prefetch(request_key)
+        if request_key in self._inflight:
+            # Already being synthesized (e.g. prefetched): wait for it instead
+            audio, _ = await asyncio.shield(self._inflight[request_key])
+            yield audio
+            return
+
+        first, rest, _ = await self._open(text, voice_id)
+        try:
+            yield first
+            if rest is not None:
+                # Part of the audio is already sent, so a failure from here on is
+                # raised rather than failed over: switching voices mid-clip is worse
+                async for chunk in rest:
+                    yield chunk
+        finally:
+            if rest is not None:
+                await rest.aclose()
+
+    async def stream_segments(self, text: str, voice_id: str,
+                              fanout: int = TTS_SEGMENT_FANOUT) -> AsyncIterator[bytes]:
+        """
+        Synthesize sentence segments concurrently (at most `fanout` at once)
+        and yield each segment's audio in the original order. Every segment
+        is cached on its own, so shared sentences are reused across texts.
+        The provider that produced the first segment is used for all of
+        them: one MP3 body must not switch voice or sample rate midway.
+        """
+        segments = split_segments(text)
+        if not segments:
+            raise ValueError("No text to synthesize")
+        # One voice for the whole readout, even for English-only segments
+        edge_voice = edge_voice_for(text)
+        tasks = []
+        provider = None
+
+        def launch_until(limit: int):
+            while len(tasks) < min(limit, len(segments)):
+                segment = segments[len(tasks)]
+                tasks.append(asyncio.create_task(
+                    self.synthesize(segment, voice_id, edge_voice=edge_voice, provider=provider)
+                ))
+
+        try:
+            # The first segment picks the provider (with failover) ...
+            launch_until(1)
+            audio, provider = await tasks[0]
+            # ... and the rest are pinned to it
+            launch_until(1 + max(1, fanout))
+            yield audio
+            for i in range(1, len(segments)):
+                launch_until(i + max(1, fanout))
+                audio, _ = await tasks[i]
+                yield audio
+        finally:
+            # Client went away or a segment failed: stop waiting. Segments
+            # already in flight still finish into the cache.
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        # Read-only (may run off the event loop): expired entries count as wasted
+        now = time.monotonic()
+        stale = sum(1 for started in list(self._prefetched.values()) if now - started > TTS_PREFETCH_TTL)
+        wasted = self.prefetch_wasted + stale
+        settled = self.prefetch_hits + wasted
+        return {
+            "concurrency": self.concurrency,
+            "router": self.router.stats(),
+            "inflight": len(self._inflight),
+            "cache": self.cache.stats(),
+            "prefetch": {
+                "started": self.prefetch_started,
+                "pending": len(self._prefetched) - stale,
+                "hits": self.prefetch_hits,
+                "joined_in_flight": self.prefetch_joined,
+                "wasted": wasted,
+                "failed": self.prefetch_failed,
+                "hit_rate": round(self.prefetch_hits / settled, 3) if settled else 0.0,
+            },
+        }
+
+
+tts_engine = TTSEngine()
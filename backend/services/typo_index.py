@@ -0,0 +1,134 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7  # Deletes are generated from this much of each word
+
+
+# Characters OCR mistakes for one another. A substitution outside these
+# ("nitrite" -> "citrate") is a different word, not a misread one.
+CONFUSABLE_GROUPS = ["il1j", "tf", "ce", "oc0", "mn", "nh", "bh", "uv", "s5", "gq9", "z2", "b86"]
+CONFUSABLE = {
+    (x, y) for group in CONFUSABLE_GROUPS for x in group for y in group if x != y
+}
+
+
+def edit_distance(a: str, b: str, limit: int, confusable_only: bool = False) -> int:
+    """
+    Optimal string alignment distance (insert, delete, substitute, swap of
+    two adjacent letters). Returns limit + 1 once it is known to exceed limit.
+    confusable_only: substitutions other than CONFUSABLE pairs are not allowed.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    prev_prev = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            if a[i - 1] == b[j - 1]:
+                cost = 0
+            elif confusable_only and (a[i - 1], b[j - 1]) not in CONFUSABLE:
+                cost = limit + 1
+            else:
+                cost = 1
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if (prev_prev is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                row[j] = min(row[j], prev_prev[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        prev_prev, prev = prev, row
+    return prev[-1]
+
+
+def max_distance_for(word: str) -> int:
+    # Short words have too many neighbours to correct safely
+    if len(word) < 4:
+        return 0
+    if len(word) <= 6:
+        return 1
+    return MAX_EDIT_DISTANCE
+
+
+class SymSpellIndex:
+    """
+    Symmetric-delete spelling index. Every vocabulary word is stored under
+    all strings reachable by deleting up to MAX_EDIT_DISTANCE letters from
+    its prefix; a misspelling is corrected by generating its own deletes and
+    verifying the few words they point at, instead of comparing against the
+    whole vocabulary.
+    """
+
+    def __init__(self, max_distance: int = MAX_EDIT_DISTANCE, prefix_length: int = PREFIX_LENGTH):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words: Dict[str, int] = {}  # word -> weight (how many names use it)
+        self._deletes: Dict[str, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.words
+
+    def _edits(self, word: str, distance: int) -> Set[str]:
+        edits = {word}
+        frontier = {word}
+        for _ in range(distance):
+            frontier = {
+                w[:i] + w[i + 1:]
+                for w in frontier if len(w) > 1
+                for i in range(len(w))
+            }
+            edits |= frontier
+        return edits
+
+    def add(self, word: str, weight: int = 1):
+        if not word:
+            return
+        if word in self.words:
+            self.words[word] += weight
+            return
+        self.words[word] = weight
+        for delete in self._edits(word[:self.prefix_length], self.max_distance):
+            self._deletes.setdefault(delete, []).append(word)
+
+    def candidates(self, word: str, max_distance: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        Every vocabulary word within max_distance as (word, distance), best
+        first (closer, then more common).
+        """
+        if word in self.words:
+            return [(word, 0)]
+
+        limit = min(self.max_distance, max_distance_for(word) if max_distance is None else max_distance)
+        if limit <= 0:
+            return []
+
+        prefix = word[:self.prefix_length]
+        seen = set()
+        found = []  # [(distance, -weight, candidate)]
+        for delete in self._edits(prefix, limit):
+            for candidate in self._deletes.get(delete, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate, limit)
+                if distance <= limit:
+                    found.append((distance, -self.words[candidate], candidate))
+
+        found.sort()
+        return [(candidate, distance) for distance, _, candidate in found]
+
+    def lookup(self, word: str, max_distance: Optional[int] = None) -> Optional[Tuple[str, int]]:
+        """
+        Closest vocabulary word as (word, distance), or None if nothing is
+        within max_distance or the best candidates tie.
+        """
+        best = self.candidates(word, max_distance)
+        if not best:
+            return None
+        if len(best) > 1 and best[0][1] == best[1][1] and self.words[best[0][0]] == self.words[best[1][0]]:
+            return None  # Equally good corrections: don't guess
+        return best[0]
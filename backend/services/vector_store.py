@@ -1,15 +1,47 @@
+import os
+import json
+import hashlib
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer      
-from typing import List, Dict
+from sentence_transformers import SentenceTransformer
+from typing import List, Dict, Optional
 
-from services.knowledge_loader import load_knowledge       
+from services.knowledge_loader import BASE_DIR, load_knowledge, knowledge_fingerprint
+from services.cache import LRUCache
+
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Bump when the document text template below changes so old caches are ignored
+TEXT_TEMPLATE_VERSION = "1"
+
+INDEX_CACHE_DIR = os.getenv(
+    "INDEX_CACHE_DIR",
+    os.path.join(BASE_DIR, ".cache", "index")
+)
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _cache_key(model_name: str) -> str:
+    raw = f"{knowledge_fingerprint()}|{model_name}|{TEXT_TEMPLATE_VERSION}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
 
 
 class VectorStore:
-    def __init__(self):
+    def __init__(self, model_name: str = MODEL_NAME, cache_dir: Optional[str] = INDEX_CACHE_DIR):
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+
+        # normalized query text -> L2-normalized embedding
+        self.query_cache = LRUCache(maxsize=QUERY_CACHE_SIZE)
+
         # Load embedding model
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+        self.model = SentenceTransformer(model_name)
 
         # Load knowledge documents
         self.documents = load_knowledge()
@@ -20,6 +52,10 @@ class VectorStore:
             for doc in self.documents
         ]
 
+        # Warm start: reuse the memory-mapped embeddings + index from disk
+        if self._load_cached_index():
+            return
+
         # Create embeddings
         embeddings = self.model.encode(self.texts, convert_to_numpy=True)
 
@@ -30,17 +66,120 @@ class VectorStore:
         dim = embeddings.shape[1]
         self.index = faiss.IndexFlatIP(dim)
         self.index.add(embeddings)
+        self.embeddings = embeddings
+
+        self._save_cached_index()
+
+    # ---------- On-disk index cache ----------
+
+    def _cache_paths(self) -> Dict[str, str]:
+        base = os.path.join(self.cache_dir, _cache_key(self.model_name))
+        return {
+            "dir": base,
+            "embeddings": os.path.join(base, "embeddings.npy"),
+            "index": os.path.join(base, "index.faiss"),
+            "manifest": os.path.join(base, "manifest.json"),
+        }
+
+    def _load_cached_index(self) -> bool:
+        if not self.cache_dir:
+            return False
+
+        try:
+            paths = self._cache_paths()
+            if not os.path.exists(paths["manifest"]):
+                return False
+
+            with open(paths["manifest"], "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+
+            # Guard against documents that were skipped/added by the loader
+            if manifest.get("ingredients") != [d["ingredient"] for d in self.documents]:
+                print("[INFO] Index cache is stale, rebuilding")
+                return False
+
+            # mmap so multiple workers share the same page cache
+            self.embeddings = np.load(paths["embeddings"], mmap_mode="r")
+
+            try:
+                self.index = faiss.read_index(
+                    paths["index"], faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+                )
+            except RuntimeError:
+                # Older faiss builds cannot mmap flat indexes
+                self.index = faiss.read_index(paths["index"])
+
+            if self.index.ntotal != len(self.documents):
+                print("[INFO] Index cache size mismatch, rebuilding")
+                return False
+
+            print(f"[INFO] Loaded cached index from {paths['dir']}")
+            return True
+
+        except Exception as e:
+            print(f"[WARNING] Failed to load index cache: {e}")
+            return False
+
+    def _save_cached_index(self):
+        if not self.cache_dir:
+            return
+
+        try:
+            paths = self._cache_paths()
+            os.makedirs(paths["dir"], exist_ok=True)
+
+            # Write to temp files and rename so concurrent workers never see partial files
+            tmp_suffix = f".{os.getpid()}.tmp"
+
+            with open(paths["embeddings"] + tmp_suffix, "wb") as f:
+                np.save(f, np.ascontiguousarray(self.embeddings, dtype=np.float32))
+            faiss.write_index(self.index, paths["index"] + tmp_suffix)
+            with open(paths["manifest"] + tmp_suffix, "w", encoding="utf-8") as f:
+                json.dump({
+                    "model": self.model_name,
+                    "ingredients": [d["ingredient"] for d in self.documents],
+                }, f)
+
+            os.replace(paths["embeddings"] + tmp_suffix, paths["embeddings"])
+            os.replace(paths["index"] + tmp_suffix, paths["index"])
+            # Manifest last: its presence marks the cache entry as complete
+            os.replace(paths["manifest"] + tmp_suffix, paths["manifest"])
+
+        except Exception as e:
+            print(f"[WARNING] Failed to write index cache: {e}")
+
+    # ---------- Search ----------
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Return normalized embeddings for queries, in order.
+        Only cache misses are sent to the model, as one batch.
+        """
+        keys = [normalize_query(q) for q in queries]
+        cached = [self.query_cache.get(k) for k in keys]
+
+        missing = list(dict.fromkeys(
+            k for k, vec in zip(keys, cached) if vec is None
+        ))
+
+        if missing:
+            encoded = self.model.encode(missing, convert_to_numpy=True).astype(np.float32)
+            faiss.normalize_L2(encoded)
+            fresh = dict(zip(missing, encoded))
+            for k, vec in fresh.items():
+                self.query_cache.set(k, vec)
+            cached = [vec if vec is not None else fresh[k] for k, vec in zip(keys, cached)]
+
+        return np.ascontiguousarray(np.stack(cached), dtype=np.float32)
 
     def search(self, query: str, top_k: int = 2) -> List[Dict]:
-        return self.search_batch([query], top_k)[0]        
+        return self.search_batch([query], top_k)[0]
 
     def search_batch(self, queries: List[str], top_k: int = 2) -> List[List[Dict]]:
         if not queries:
             return []
 
-        # encode batch
-        query_embeddings = self.model.encode(queries, convert_to_numpy=True)
-        faiss.normalize_L2(query_embeddings)
+        query_embeddings = self.embed_queries(queries)
 
         # search batch
         # D: distances (scores), I: indices
@@ -49,17 +188,16 @@ class VectorStore:
         all_results = []
         for i in range(len(queries)):
             query_results = []
-            for score, idx in zip(scores[i], indices[i]):  
+            for score, idx in zip(scores[i], indices[i]):
                 if idx == -1: continue # Should not happen with IndexFlatIP unless empty
                 doc = self.documents[idx]
                 query_results.append({
-                    "ingredient": doc["ingredient"],       
+                    "ingredient": doc["ingredient"],
                     "role": doc["role"],
                     "summary": doc["summary"],
                     "evidence": doc["evidence"],
-                    "confidence_score": float(score)       
+                    "confidence_score": float(score)
                 })
             all_results.append(query_results)
 
         return all_results
-
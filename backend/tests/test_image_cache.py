@@ -0,0 +1,33 @@
+import io
+
+from PIL import Image
+
+from services.image_cache import ImageResultCache, image_fingerprint
+
+
+def _label(shade: int) -> bytes:
+    image = Image.new("L", (64, 64), 255)
+    image.paste(shade, (8, 8, 40, 56))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_exact_image_hits():
+    cache = ImageResultCache()
+    fingerprint = image_fingerprint(_label(0))
+    cache.set(fingerprint, "sugar, salt")
+
+    assert cache.get(image_fingerprint(_label(0))) == "sugar, salt"
+    assert cache.get(fingerprint, variant="hi") is None
+
+
+def test_similar_looking_label_misses():
+    cache = ImageResultCache()
+    first, second = image_fingerprint(_label(0)), image_fingerprint(_label(10))
+    assert first[0] != second[0] and first[1] == second[1]
+
+    cache.set(first, "sugar, salt")
+
+    assert cache.get(second) is None
+    assert cache.stats()["hits"] == 0
@@ -0,0 +1,60 @@
+import pytest
+
+from services.knowledge_loader import load_knowledge
+from services.lexical_index import LexicalIndex
+
+
+@pytest.fixture(scope="module")
+def index():
+    return LexicalIndex(load_knowledge())
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("sodum benzoate", "Sodium Benzoate"),
+    ("Tartrazin", "Tartrazine"),
+    ("monosodium glutamte", "Monosodium Glutamate"),
+    ("potasium sorbate", "Potassium Sorbate"),
+    ("sodiumbenzoate", "Sodium Benzoate"),
+    ("sodium benz oate", "Sodium Benzoate"),
+])
+def test_corrects_damaged_knowledge_names(index, name, expected):
+    doc = index.correct(name)
+    assert doc is not None
+    assert doc["ingredient"] == expected
+
+
+@pytest.mark.parametrize("name", [
+    "sucrlose",   # sucralose, not sucrose (Sugar)
+    "Sucrolose",
+    "ualt",       # malt, not Salt
+    "iglucose",   # glucose, not isoglucose (High Fructose Corn Syrup)
+    "malt",
+])
+def test_typos_of_lexicon_words_are_not_forced_onto_knowledge(index, name):
+    assert index.correct(name) is None
+
+
+@pytest.mark.parametrize("name", [
+    "Sodium Nitrite",     # not Sodium Citrate
+    "Sodium Nitrate",
+    "Potassium Bromide",  # not Potassium Bromate
+    "Nitric Acid",        # not Citric Acid
+    "Salty",              # not Salt
+])
+def test_near_miss_chemicals_are_not_corrected(index, name):
+    assert index.correct(name) is None
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("citrlc acid", "Citric Acid"),
+    ("Sodlum Benzoate", "Sodium Benzoate"),
+])
+def test_ocr_confusions_are_corrected(index, name, expected):
+    assert index.correct(name)["ingredient"] == expected
+
+
+def test_lexicon_tie_blocks_knowledge_correction():
+    docs = [{"ingredient": "Salt", "aliases": []}]
+    index = LexicalIndex(docs, lexicon=["Malt"])
+    assert index.correct("ualt") is None
+    assert index.correct("sallt")["ingredient"] == "Salt"
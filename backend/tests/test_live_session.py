@@ -0,0 +1,70 @@
+import io
+
+import pytest
+from PIL import Image
+
+live_session = pytest.importorskip("services.live_session")
+
+LABEL = "Ingredients: sugar, salt"
+
+
+def _frame(shade: int = 0) -> bytes:
+    image = Image.new("L", (64, 64), 255)
+    image.paste(shade, (8, 8, 40, 56))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class FakeRag:
+    def retrieve_context_batch(self, names):
+        return [
+            {"ingredient": name, "matched_ingredient": name.title(), "match_type": "lexical",
+             "similarity_score": 1.0, "context": []}
+            for name in names
+        ]
+
+
+class FakePipeline:
+    rag = FakeRag()
+
+
+@pytest.fixture
+def session(monkeypatch):
+    reads = []
+
+    def extract_text_from_image(image_bytes, fingerprint=None):
+        reads.append(image_bytes)
+        return LABEL
+
+    clock = [100.0]
+    monkeypatch.setattr(live_session, "extract_text_from_image", extract_text_from_image)
+    monkeypatch.setattr(live_session.time, "monotonic", lambda: clock[0])
+    live = live_session.LiveSession(FakePipeline())
+    return live, reads, clock
+
+
+def test_steady_camera_confirms_and_explains(session):
+    live, reads, clock = session
+    frame = _frame()
+    summaries = []
+    for _ in range(6):
+        summaries.append(live.add_frame(frame))
+        clock[0] += 0.5
+
+    assert len(reads) == 1
+    assert all(summary["skipped"] for summary in summaries[1:])
+    assert all(item["confirmed"] for item in summaries[-1]["ingredients"])
+    assert {item["ingredient"] for item in live.pending()} == {"Sugar", "Salt"}
+
+
+def test_burst_of_duplicate_frames_does_not_confirm(session):
+    live, reads, clock = session
+    frame = _frame()
+    for _ in range(6):
+        summary = live.add_frame(frame)
+        clock[0] += 0.05
+
+    assert len(reads) == 1
+    assert not any(item["confirmed"] for item in summary["ingredients"])
+    assert live.pending() == []
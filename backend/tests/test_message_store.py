@@ -0,0 +1,137 @@
+import threading
+
+from services.message_store import MessageWriter, InMemoryMessageBackend
+
+
+def message(i, **fields):
+    return {"session_id": "s1", "role": "user", "content": f"m{i}", **fields}
+
+
+class FlakyBackend(InMemoryMessageBackend):
+    """Fails the first `failures` inserts with a transient (network) error."""
+
+    def __init__(self, failures=0):
+        super().__init__()
+        self.failures = failures
+        self.calls = []
+
+    def insert_many(self, rows):
+        self.calls.append(len(rows))
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection reset")
+        super().insert_many(rows)
+
+
+def contents(backend, session_id="s1"):
+    return [row["content"] for row in backend.select_session(session_id)]
+
+
+def test_sync_mode_writes_on_the_calling_thread():
+    backend = InMemoryMessageBackend()
+    writer = MessageWriter(backend=backend, sync=True)
+    writer.enqueue(message(0))
+    assert contents(backend) == ["m0"]
+    assert writer.stats()["mode"] == "sync"
+
+
+def test_rows_are_batched_and_drain_flushes_the_rest():
+    backend = FlakyBackend()
+    writer = MessageWriter(backend=backend, batch_size=3, flush_interval=5, sync=False)
+    writer.start()
+    for i in range(7):
+        writer.enqueue(message(i))
+    writer.drain()
+
+    assert contents(backend) == [f"m{i}" for i in range(7)]
+    assert sum(backend.calls) == 7
+    assert max(backend.calls) == 3
+    assert writer.stats()["queued"] == 0
+
+
+def test_transient_errors_are_retried():
+    backend = FlakyBackend(failures=2)
+    writer = MessageWriter(backend=backend, max_retries=3, sync=True)
+    writer.enqueue(message(0))
+
+    assert contents(backend) == ["m0"]
+    assert writer.retries == 2
+    assert writer.dropped == 0
+
+
+def test_rows_are_dropped_after_max_retries():
+    backend = FlakyBackend(failures=10)
+    writer = MessageWriter(backend=backend, max_retries=1, sync=True)
+    writer.enqueue(message(0))
+
+    assert contents(backend) == []
+    assert writer.dropped == 1
+
+
+def test_refused_row_is_dropped_alone():
+    backend = FlakyBackend()
+    writer = MessageWriter(backend=backend, batch_size=4, flush_interval=5, sync=False)
+    writer.start()
+    writer.enqueue(message(0))
+    writer.enqueue(message(1, content=None))  # NOT NULL violation
+    writer.enqueue(message(2))
+    writer.enqueue(message(3))
+    writer.drain()
+
+    assert contents(backend) == ["m0", "m2", "m3"]
+    assert writer.dropped == 1
+    assert writer.split_batches == 1
+    assert writer.retries == 0  # Refusals are not retried
+
+
+def test_drain_without_start_is_a_no_op():
+    writer = MessageWriter(backend=InMemoryMessageBackend(), sync=False)
+    writer.drain()
+    assert not any(t.name == "message-writer" for t in threading.enumerate())
+
+
+def test_flush_writes_one_sessions_queued_rows():
+    backend = FlakyBackend()
+    writer = MessageWriter(backend=backend, batch_size=10, flush_interval=5, sync=False)
+    writer.start()
+    writer.enqueue(message(0))
+    writer.enqueue(message(1, session_id="s2"))
+    writer.enqueue(message(2))
+    writer.flush("s1")
+
+    assert contents(backend) == ["m0", "m2"]
+    assert contents(backend, "s2") == []
+    writer.drain()
+    assert contents(backend, "s2") == ["m1"]
+
+
+class SlowBackend(InMemoryMessageBackend):
+    """Holds every insert until `release` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def insert_many(self, rows):
+        self.started.set()
+        self.release.wait(5)
+        super().insert_many(rows)
+
+
+def test_flush_waits_for_a_batch_in_flight():
+    backend = SlowBackend()
+    writer = MessageWriter(backend=backend, batch_size=1, flush_interval=5, sync=False)
+    writer.start()
+    writer.enqueue(message(0))
+    assert backend.started.wait(5)
+
+    flusher = threading.Thread(target=writer.flush, args=("s1",))
+    flusher.start()
+    flusher.join(0.2)
+    assert flusher.is_alive()  # The row is neither queued nor in the table yet
+
+    backend.release.set()
+    flusher.join(5)
+    assert contents(backend) == ["m0"]
+    writer.drain()
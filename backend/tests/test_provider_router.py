@@ -0,0 +1,48 @@
+from services import provider_router
+from services.provider_router import MIN_SAMPLES, TTS_BREAKER_COOLDOWN, ProviderRouter
+
+PLAN = [("elevenlabs", "voice", "mp3"), ("edge", "en-IN-NeerjaNeural", "mp3")]
+
+
+def _providers(router):
+    return [entry[0] for entry in router.order(PLAN)]
+
+
+def test_healthy_primary_keeps_its_place():
+    router = ProviderRouter(deadline=6)
+    for _ in range(MIN_SAMPLES):
+        router.success("elevenlabs", 0.8)
+    assert _providers(router) == ["elevenlabs", "edge"]
+
+
+def test_slow_primary_goes_behind_the_fallback():
+    router = ProviderRouter(deadline=6)
+    for _ in range(MIN_SAMPLES):
+        router.success("elevenlabs", 8.0)
+    assert _providers(router) == ["edge", "elevenlabs"]
+
+
+def test_unreliable_primary_goes_behind_the_fallback():
+    router = ProviderRouter(deadline=6)
+    for i in range(MIN_SAMPLES * 2):
+        if i % 4 == 0:
+            router.success("elevenlabs", 0.8)
+        else:
+            router.failure("elevenlabs", RuntimeError("quota exceeded"))
+    assert _providers(router) == ["edge", "elevenlabs"]
+
+
+def test_too_few_samples_do_not_reorder():
+    router = ProviderRouter(deadline=6)
+    for _ in range(MIN_SAMPLES - 1):
+        router.success("elevenlabs", 8.0)
+    assert _providers(router) == ["elevenlabs", "edge"]
+
+
+def test_demotion_expires_once_the_numbers_are_stale(monkeypatch):
+    router = ProviderRouter(deadline=6)
+    for _ in range(MIN_SAMPLES):
+        router.success("elevenlabs", 8.0)
+    later = router.health("elevenlabs").last_call + TTS_BREAKER_COOLDOWN
+    monkeypatch.setattr(provider_router.time, "monotonic", lambda: later)
+    assert _providers(router) == ["elevenlabs", "edge"]